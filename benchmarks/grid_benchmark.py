@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time regular grid generation at increasing cell counts, comparing the
+per-cell shapely.geometry.box construction with the vectorized path.
+"""
+
+import time
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import box
+
+from keras_spatial.samples import regular_grid
+
+
+def percell_grid(xmin, ymin, xmax, ymax, xsize, ysize):
+    x = np.linspace(xmin, xmax-xsize, num=int((xmax-xmin)//xsize))
+    y = np.linspace(ymin, ymax-ysize, num=int((ymax-ymin)//ysize))
+    X,Y = np.meshgrid(x, y)
+    polys = [box(x, y, x+xsize, y+ysize) for x,y in np.nditer([X,Y])]
+    return gpd.GeoDataFrame({'geometry':polys})
+
+
+def benchmark(cells, percell=True):
+    side = int(np.sqrt(cells))
+    extent = (0.0, 0.0, side * 100.0, side * 100.0)
+
+    start = time.perf_counter()
+    df = regular_grid(*extent, 100.0, 100.0)
+    vectorized = time.perf_counter() - start
+
+    if percell:
+        start = time.perf_counter()
+        percell_grid(*extent, 100.0, 100.0)
+        elapsed = '{:.2f}s'.format(time.perf_counter() - start)
+    else:
+        elapsed = 'skipped'
+
+    print('{:>10d} cells  vectorized {:.2f}s  per-cell {}'.format(
+            len(df), vectorized, elapsed))
+
+
+if __name__ == '__main__':
+    benchmark(10**5)
+    benchmark(10**6)
+    benchmark(10**7, percell=False)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Count raster blocks decoded per sample for a shuffled sample set read in
+dataframe order and with each spatial order, using a block cache sized
+well below the raster so it behaves like a bounded GDAL block cache.
+"""
+
+import os
+import time
+import tempfile
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.cache import BlockCache
+
+
+def make_raster(path, size=8192, blocksize=256):
+    profile = dict(driver='GTiff', count=1, dtype='uint8', crs='EPSG:3857',
+            width=size, height=size, transform=from_origin(0, size, 1, 1),
+            tiled=True, blockxsize=blocksize, blockysize=blocksize)
+    with rasterio.open(path, 'w', **profile) as dst:
+        for row in range(0, size, 1024):
+            dst.write(np.full((1, 1024, size), row // 1024, dtype='uint8'),
+                    window=((row, row+1024), (0, size)))
+
+
+def benchmark(sdg, df, order):
+    sdg.block_cache.clear()
+    start = time.perf_counter()
+    for _ in sdg.flow_from_dataframe(df, 64, 64, batch_size=32, order=order):
+        pass
+    elapsed = time.perf_counter() - start
+    print('{:>8s}  {:.2f} blocks/sample  {:.2f}s'.format(str(order),
+            sdg.block_cache.misses / len(df), elapsed))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tiled.tif')
+        make_raster(path)
+
+        # 64 blocks of 64KiB, 1/16th of the raster
+        sdg = SpatialDataGenerator(path, block_cache=BlockCache(64 * 2**16))
+        df = sdg.random_grid(64, 64, 20000)
+        df = df.iloc[np.random.default_rng(0).permutation(len(df))]
+
+        for order in (None, 'zorder', 'hilbert', 'block'):
+            benchmark(sdg, df, order)
+
+
+if __name__ == '__main__':
+    main()
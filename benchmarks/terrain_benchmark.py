@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time terrain_analysis on a batch of patches, comparing the per-sample
+convolve2d implementation with the shared-sum batch implementation in
+float64 and float32.
+"""
+
+import time
+import numpy as np
+from scipy import signal
+
+from keras_spatial.augmentation import terrain_analysis
+
+
+def percall_terrain(array, size):
+    px, py = size[0]/array.shape[-1], size[1]/array.shape[-2]
+    g = [[-1/(6*px), 0, 1/(6*px)]] * 3
+    h = [[1/(6*py)]*3, [0]*3, [-1/(6*py)]*3]
+    d = [[1/(3*px**2), -2/(3*px**2), 1/(3*px**2)]] * 3
+    e = [[1/(3*py**2)]*3, [-2/(3*py**2)]*3, [1/(3*py**2)]*3]
+    f = [[-1/(4*px*py), 0, 1/(4*px*py)], [0, 0, 0],
+         [1/(4*px*py), 0, -1/(4*px*py)]]
+    gi, hi, di, ei, fi = [signal.convolve2d(array, k, boundary='symm',
+            mode='same') for k in (g, h, d, e, f)]
+
+    slope = np.sqrt(np.power(hi,2) + np.power(gi,2))
+    aspect = np.arctan(hi/gi)
+    planc = -1*((np.power(hi,2)*di) - (2*gi*hi*fi) + (np.power(gi,2)*ei)
+            / (np.power((np.power(gi,2) + np.power(hi,2)),1.5)))
+    profc = -1*(((np.power(gi,2)*di) + (2*gi*hi*fi) + (np.power(hi,2)*ei))
+            / ((np.power(gi,2) + np.power(hi,2))
+            * (np.power((1 + np.power(gi,2) + np.power(hi,2)),1.5))))
+    meanc = -1*(((1 + np.power(hi,2))*di) - (2*gi*hi*fi)
+            + ((1 + np.power(gi,2))*ei)
+            / (2*np.power((1 + np.power(gi,2) + np.power(hi,2)),1.5)))
+    return np.stack([array, slope, aspect, planc, profc, meanc], axis=0)
+
+
+def timeit(func, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count=64, size=128):
+    rng = np.random.default_rng(0)
+    batch = rng.normal(0, 1, (count, size, size)).cumsum(axis=1)
+    batch = batch.astype(np.float32)
+    extent = (size * 1.0, size * 1.0)
+    out = np.empty((count, 6, size, size), dtype=np.float32)
+
+    with np.errstate(all='ignore'):
+        percall = timeit(lambda: np.stack([percall_terrain(a, extent)
+                for a in batch]))
+        batched = timeit(lambda: terrain_analysis(batch, extent))
+        float32 = timeit(lambda: terrain_analysis(batch, extent,
+                dtype=np.float32, out=out))
+
+    print('{} patches of {}x{}'.format(count, size, size))
+    print('  per-sample convolve2d  {:.3f}s'.format(percall))
+    print('  batch float64          {:.3f}s  {:.1f}x'.format(batched,
+            percall / batched))
+    print('  batch float32, out=    {:.3f}s  {:.1f}x'.format(float32,
+            percall / float32))
+
+
+if __name__ == '__main__':
+    main()
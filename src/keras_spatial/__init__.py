@@ -11,3 +11,5 @@ finally:
     del get_distribution, DistributionNotFound
 
 from .datagen import SpatialDataGenerator
+from .sequence import SpatialSequence
+from .multisource import MultiSourceGenerator
@@ -23,47 +23,272 @@ def normalize(arr, gmin, gmax, layer=0):
         arr[layer,:,:] = (arr[layer] - gmin) / (gmax - gmin)
         return arr
 
-from scipy import signal
-def terrain_analysis(array, size):
+def normalize_batch(batch, gmin=None, gmax=None, mean=None, std=None,
+        interleave='pixel', dtype=np.float32, out=None):
+    """scales every band of a batch in a single broadcast operation
+
+    Bands are scaled to the range (0,1) with gmin and gmax or to zero
+    mean and unit variance with mean and std. Parameters are scalars or
+    have one value per band, bands with no range or no variance become
+    0. The batch is not modified unless it is passed as out, which must
+    be a floating point array, so integer batches cannot be normalized in
+    place.
+
+    Args:
+      batch (ndarray): (N,h,w), (N,h,w,bands) or (N,bands,h,w) batch
+      gmin (float|ndarray): per band sample set minimum
+      gmax (float|ndarray): per band sample set maximum
+      mean (float|ndarray): per band sample set mean
+      std (float|ndarray): per band sample set standard deviation
+      interleave (str): type of interleave, 'pixel' or 'band'
+      dtype (dtype): result type, float32 or float16 (default=float32)
+      out (ndarray): optional floating point array receiving the result,
+              may be batch
+
+    Returns:
+      (ndarray):
+
+    Raises:
+      TypeError: if out is not a floating point array
+    """
+
+    if gmin is not None and gmax is not None:
+        shift, spread = gmin, np.subtract(gmax, gmin, dtype=np.float64)
+    elif mean is not None and std is not None:
+        shift, spread = mean, np.asarray(std, dtype=np.float64)
+    else:
+        raise ValueError('gmin and gmax or mean and std are required')
+
+    with np.errstate(divide='ignore'):
+        scale = np.where(spread > 0, 1 / spread, 0).astype(np.float32)
+    shift = np.asarray(shift, dtype=np.float32)
+    if batch.ndim == 4 and interleave == 'band':
+        shift, scale = shift.reshape(-1, 1, 1), scale.reshape(-1, 1, 1)
+
+    if out is None:
+        out = np.empty(batch.shape, dtype=dtype)
+    elif not np.issubdtype(out.dtype, np.floating):
+        raise TypeError('out must be a floating point array, not {}'.format(
+                out.dtype))
+
+    # half precision results are computed in single precision first
+    work = out if out.dtype.itemsize >= 4 else None
+    work = np.subtract(batch, shift, out=work, dtype=np.float32)
+    np.multiply(work, scale, out=work)
+    if work is not out:
+        out[...] = work
+    return out
+
+def terrain_analysis(array, size, dtype=None, out=None):
     """calculate terrain derivatives based on the Evans Young method
 
+    The five 3x3 derivative kernels share their row and column sums, so
+    the symmetric padded array is summed once along each axis and every
+    derivative is a few array additions. A single (h,w) sample or an
+    (N,h,w) batch is processed in one call.
+
     Args:
-      array (ndarray): elevation data array
+      array (ndarray): elevation data array, (h,w) or (N,h,w)
       size (float,float): size of sample in projected coordinates
+      dtype (dtype): type used for the calculation and result
+              (default=float64)
+      out (ndarray): optional array receiving the result
 
     Returns:
-      (ndarray): 3d array with original elevation data and derivatives
+      (ndarray): (6,h,w) or (N,6,h,w) array with original elevation data
+              and slope, aspect, plan, profile and mean curvature
     """
 
-    px, py = size[0]/array.shape[-1], size[1]/array.shape[-2]
-
-    g = [[(-1/(6*px)), 0 , (1/(6*px))],
-         [(-1/(6*px)), 0 , (1/(6*px))],
-         [(-1/(6*px)), 0 , (1/(6*px))]]
-    h = [[(1/(6*py)),(1/(6*py)),(1/(6*py))],
-         [0,0,0],
-         [(-1/(6*py)),(-1/(6*py)),(-1/(6*py))]]
-    d = [[(1/(3*(px**2))),(-2/(3*(px**2))),(1/(3*(px**2)))],
-         [(1/(3*(px**2))),(-2/(3*(px**2))),(1/(3*(px**2)))],
-         [(1/(3*(px**2))),(-2/(3*(px**2))),(1/(3*(px**2)))]]
-    e = [[(1/(3*(py**2))),(1/(3*(py**2))),(1/(3*(py**2)))],
-         [(-2/(3*(py**2))),(-2/(3*(py**2))),(-2/(3*(py**2)))],
-         [(1/(3*(py**2))),(1/(3*(py**2))),(1/(3*(py**2)))]]
-    f = [[(-1/(4*(px*py))),0, (1/(4*(px*py)))],
-         [0,0,0],
-         [(1/(4*(px*py))),0,(-1/(4*(px*py)))]]
-
-    gi = signal.convolve2d(array, g, boundary='symm', mode='same')
-    hi = signal.convolve2d(array, h, boundary='symm', mode='same')
-    di = signal.convolve2d(array, d, boundary='symm', mode='same')
-    ei = signal.convolve2d(array, e, boundary='symm', mode='same')
-    fi = signal.convolve2d(array, f, boundary='symm', mode='same')
-
-    slope  = np.sqrt (np.power(hi,2)+np.power(gi,2))
-    aspect = np.arctan(hi/gi)
-    planc  = -1*((np.power(hi, 2)*di)-(2*gi*hi*fi)+(np.power(gi,2)*ei)/(np.power((np.power(gi,2)+np.power(hi,2)),1.5)))
-    profc  = -1*(((np.power(gi,2)*di)+(2*gi*hi*fi) +(np.power(hi,2)*ei))/ ((np.power(gi,2)+np.power(hi,2))*(np.power( (1+np.power(gi,2)+np.power(hi,2)),1.5)) ))
-    meanc  = -1 *( ((1+np.power(hi,2))*di) -(2*gi*hi*fi) +((1+np.power(gi,2))*ei) / (2*np.power( (1+np.power(gi,2)+np.power(hi,2)),1.5)  ))
-
-    return np.stack([array, slope, aspect, planc, profc,meanc], axis=0)
+    dtype = np.dtype(dtype if dtype else np.float64)
+    h, w = array.shape[-2:]
+    px, py = size[0]/w, size[1]/h
+
+    pad = [(0, 0)] * (array.ndim - 2) + [(1, 1), (1, 1)]
+    z = np.pad(np.asarray(array, dtype=dtype), pad, mode='symmetric')
+
+    # column sums (h, w+2) and row sums (h+2, w) of each 3x3 window
+    cols = z[..., :-2, :] + z[..., 1:-1, :] + z[..., 2:, :]
+    rows = z[..., :, :-2] + z[..., :, 1:-1] + z[..., :, 2:]
+    left, center, right = cols[..., :-2], cols[..., 1:-1], cols[..., 2:]
+    top, middle, bottom = (rows[..., :-2, :], rows[..., 1:-1, :],
+            rows[..., 2:, :])
+
+    # the kernels are applied as convolutions, i.e. flipped
+    gi = (left - right) * dtype.type(1/(6*px))
+    hi = (bottom - top) * dtype.type(1/(6*py))
+    di = (left - 2*center + right) * dtype.type(1/(3*px**2))
+    ei = (top - 2*middle + bottom) * dtype.type(1/(3*py**2))
+    fi = ((z[..., :-2, 2:] + z[..., 2:, :-2] - z[..., :-2, :-2]
+            - z[..., 2:, 2:]) * dtype.type(1/(4*px*py)))
+
+    if out is None:
+        out = np.empty(array.shape[:-2] + (6, h, w), dtype=dtype)
+    elevation, slope, aspect, planc, profc, meanc = np.moveaxis(out, -3, 0)
+    elevation[...] = array
+
+    p2, q2 = gi*gi, hi*hi
+    pq = p2 + q2
+    gradient = 1 + pq
+    gradient *= np.sqrt(gradient)
+    twist = 2*gi*hi*fi
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.sqrt(pq, out=slope)
+        np.arctan(hi/gi, out=aspect)
+        np.negative(q2*di - twist + p2*ei/(pq*np.sqrt(pq)), out=planc)
+        np.negative((p2*di + twist + q2*ei) / (pq*gradient), out=profc)
+        np.negative((1 + q2)*di - twist + (1 + p2)*ei/(2*gradient),
+                out=meanc)
+
+    return out
+
+
+class GeometricAugmenter(object):
+
+    # generators pass the (epoch, batch number) of each batch as index
+    indexed = True
+
+    def __init__(self, rotate=True, flip=True, crop=None, seed=None,
+            interleave='pixel'):
+        """Random 90 degree rotations, flips and crops of whole batches
+
+        Every sample gets its own transform, applied to the batch with a
+        single fancy index instead of a loop over samples. Transforms are
+        drawn from a generator seeded by (seed, epoch, batch number), so
+        an epoch is reproducible, or afresh for every batch when seed is
+        not set. Calling with several batches applies the same transforms
+        to each.
+
+        An instance can be registered as a batch preprocess callback, the
+        generator then passes the batch number of every batch, and the
+        epoch when it is given one, so augmenters with the same seed,
+        e.g. one for an image source and one for its label source,
+        transform matching batches of the same dataframe identically
+        regardless of the order batches are read in. Otherwise batches
+        are numbered by an internal counter. The epoch is the one set
+        with set_epoch unless the generator passes it.
+
+        Args:
+          rotate (bool): random multiples of 90 degrees, only 180 degrees
+                  for samples that are not square
+          flip (bool): random flips
+          crop ((int, int)): optional (width, height) of random crops
+          seed (int): random seed (default=None for new transforms on
+                  every call)
+          interleave (str): type of interleave, 'pixel' or 'band'
+        """
+
+        self.rotate = rotate
+        self.flip = flip
+        self.crop = crop
+        self.seed = seed
+        self.interleave = interleave
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """Restart the transform sequence for an epoch
+
+        Args:
+          epoch (int): epoch number
+        """
+
+        self.epoch = epoch
+        self.batch = 0
+
+    def params(self, count, height, width, batch=None, epoch=None):
+        """Draw transforms for a batch
+
+        Args:
+          count (int): number of samples
+          height (int): sample height in pixels
+          width (int): sample width in pixels
+          batch (int): batch number (default=next batch)
+          epoch (int): epoch number (default=self.epoch)
+
+        Returns:
+          (dict): per sample rotation k, flip and crop offsets
+        """
+
+        if batch is None:
+            batch, self.batch = self.batch, self.batch + 1
+        epoch = self.epoch if epoch is None else epoch
+        if self.seed is None:
+            rng = np.random.default_rng()
+        else:
+            rng = np.random.default_rng([self.seed, epoch, batch])
+
+        if not self.rotate:
+            k = np.zeros(count, dtype=int)
+        elif height == width:
+            k = rng.integers(0, 4, count)
+        else:
+            k = rng.integers(0, 2, count) * 2
+        flip = rng.integers(0, 2, count) if self.flip else \
+                np.zeros(count, dtype=int)
+
+        cw, ch = self.crop if self.crop else (width, height)
+        if cw > width or ch > height:
+            raise ValueError('crop is larger than the samples')
+        return dict(k=k, flip=flip,
+                row=rng.integers(0, height - ch + 1, count),
+                col=rng.integers(0, width - cw + 1, count), size=(ch, cw))
+
+    def _grids(self, height, width):
+        """flat source index of every pixel for the 8 transforms"""
+
+        idx = np.arange(height * width).reshape(height, width)
+        grids = []
+        for flip in (idx, idx[::-1]):
+            for k in range(4):
+                grid = np.rot90(flip, k)
+                grids.append(grid if grid.shape == idx.shape else idx)
+        return np.stack(grids)
+
+    def apply(self, batch, params):
+        """Apply drawn transforms to a batch
+
+        Args:
+          batch (ndarray): (N,h,w), (N,h,w,bands) or (N,bands,h,w) batch
+          params (dict): transforms returned by params
+
+        Returns:
+          (ndarray): new augmented batch
+        """
+
+        band = batch.ndim == 4 and self.interleave == 'band'
+        height, width = batch.shape[-2:] if band else batch.shape[1:3]
+        ch, cw = params['size']
+        n = np.arange(len(batch))[:, None, None]
+
+        # source pixel of each output pixel, then one gather per batch
+        grids = self._grids(height, width)[params['flip'] * 4 + params['k']]
+        grids = grids[n, params['row'][:, None, None] + np.arange(ch)[:, None],
+                params['col'][:, None, None] + np.arange(cw)]
+
+        if band:
+            flat = batch.reshape(batch.shape[:2] + (-1,))
+            return np.moveaxis(flat[n, :, grids], -1, 1)
+        flat = batch.reshape((len(batch), -1) + batch.shape[3:])
+        return flat[n, grids]
+
+    def __call__(self, batch, *batches, index=None):
+        """Augment one batch, or several with the same transforms
+
+        Args:
+          batch (ndarray): batch to augment
+          batches (ndarray): optional batches given the same transforms
+          index ((int, int)): optional (epoch, batch number) of the batch,
+                  an epoch of None uses the set_epoch epoch (default=the
+                  set_epoch epoch and the next batch number)
+
+        Returns:
+          (ndarray | tuple(ndarray)): augmented batch or batches
+        """
 
+        band = batch.ndim == 4 and self.interleave == 'band'
+        height, width = batch.shape[-2:] if band else batch.shape[1:3]
+        epoch, number = index if index is not None else (None, None)
+        params = self.params(len(batch), height, width, number, epoch)
+        if not batches:
+            return self.apply(batch, params)
+        return tuple(self.apply(b, params) for b in (batch,) + batches)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Caches that avoid re-reading raster data: an on-disk cache of extracted
+patches stored in chunked memory-mapped arrays so repeated epochs read
+patches without decoding or warping, and a bounded in-memory cache of
+decoded raster blocks shared by overlapping samples.
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import collections
+
+import numpy as np
+from rasterio.windows import Window
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+def source_identity(source):
+    """Return a description of source that changes when the source does.
+
+    Args:
+      source (str): local file path or URL
+
+    Returns:
+      (dict)
+    """
+
+    if os.path.exists(source):
+        stat = os.stat(source)
+        return dict(source=os.path.abspath(source), size=stat.st_size,
+                mtime=stat.st_mtime_ns)
+    return dict(source=source)
+
+
+class PatchStore(object):
+
+    def __init__(self, path, identity, shape, dtype, chunk_size=1024):
+        """Patches for a single source and profile
+
+        Patches are appended to fixed size chunk files. Each chunk has a
+        companion array with the bounds of every patch, written after the
+        patch itself, which doubles as the persistent index.
+
+        Args:
+          path (str): store directory
+          identity (dict): source identity, store is cleared on mismatch
+          shape (tuple): shape of a single patch
+          dtype (dtype): patch type
+          chunk_size (int): patches per chunk file
+        """
+
+        self.path = path
+        self.identity = identity
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.index = {}
+        self.count = 0
+        self.chunks = []
+
+        meta = dict(identity=identity, shape=self.shape, dtype=self.dtype.str,
+                chunk_size=chunk_size)
+        meta = json.loads(json.dumps(meta))
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) != meta:
+                    _logger.info('source changed, clearing %s', path)
+                    shutil.rmtree(path)
+
+        if not os.path.exists(meta_path):
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+
+        self._load()
+
+    def _chunk(self, n, mode='r+'):
+        data = os.path.join(self.path, 'chunk_{:05d}.npy'.format(n))
+        bounds = os.path.join(self.path, 'bounds_{:05d}.npy'.format(n))
+        if mode == 'w+':
+            np.lib.format.open_memmap(bounds, mode='w+', dtype=np.float64,
+                    shape=(self.chunk_size, 4))[:] = np.nan
+        return (np.lib.format.open_memmap(data, mode=mode, dtype=self.dtype,
+                    shape=(self.chunk_size,) + self.shape),
+                np.lib.format.open_memmap(bounds, mode='r+'))
+
+    def _load(self):
+        """rebuild the index from the chunk bounds arrays"""
+
+        files = sorted(glob.glob(os.path.join(self.path, 'bounds_*.npy')))
+        for n in range(len(files)):
+            self.chunks.append(self._chunk(n))
+            valid = ~np.isnan(self.chunks[-1][1][:,0])
+            for row in np.flatnonzero(valid):
+                key = self.chunks[-1][1][row].tobytes()
+                self.index[key] = n * self.chunk_size + row
+            if valid.any():
+                self.count = (n * self.chunk_size +
+                        np.flatnonzero(valid)[-1] + 1)
+
+    def get(self, bounds, out):
+        """Copy cached patches into out
+
+        Args:
+          bounds (ndarray): (N,4) sample bounds
+          out (ndarray): array receiving N patches
+
+        Returns:
+          (ndarray): positions of samples not in the cache
+        """
+
+        bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+        missing = []
+        for i, b in enumerate(bounds):
+            pos = self.index.get(b.tobytes())
+            if pos is None:
+                missing.append(i)
+            else:
+                n, row = divmod(pos, self.chunk_size)
+                out[i] = self.chunks[n][0][row]
+        return np.array(missing, dtype=int)
+
+    def put(self, bounds, patches):
+        """Append patches to the cache
+
+        Args:
+          bounds (ndarray): (N,4) sample bounds
+          patches (ndarray): N patches
+        """
+
+        bounds = np.ascontiguousarray(bounds, dtype=np.float64)
+        for b, patch in zip(bounds, patches):
+            key = b.tobytes()
+            if key in self.index:
+                continue
+            n, row = divmod(self.count, self.chunk_size)
+            if n == len(self.chunks):
+                self.chunks.append(self._chunk(n, mode='w+'))
+            data, index = self.chunks[n]
+            data[row] = patch
+            index[row] = b
+            self.index[key] = self.count
+            self.count += 1
+
+    def flush(self):
+        """Write modified chunks to disk"""
+
+        for data, bounds in self.chunks:
+            data.flush()
+            bounds.flush()
+
+    def __len__(self):
+        return self.count
+
+
+class PatchCache(object):
+
+    def __init__(self, path, chunk_size=1024):
+        """Directory of patch stores keyed by source and profile
+
+        Args:
+          path (str): cache directory
+          chunk_size (int): patches per chunk file
+        """
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.stores = {}
+
+    def __getstate__(self):
+        """Drop open stores so the cache can be pickled"""
+
+        state = self.__dict__.copy()
+        state['stores'] = {}
+        return state
+
+    def store(self, source, profile, shape, dtype):
+        """Return the store for a source and generator profile
+
+        Args:
+          source (str): local file path or URL
+          profile (dict): parameters affecting the patch contents
+          shape (tuple): shape of a single patch
+          dtype (dtype): patch type
+
+        Returns:
+          (PatchStore)
+        """
+
+        key = json.dumps(dict(profile, source=source, shape=tuple(shape),
+                dtype=np.dtype(dtype).str), sort_keys=True, default=str)
+        name = hashlib.sha1(key.encode()).hexdigest()
+        identity = source_identity(source)
+        store = self.stores.get(name)
+        if store is None or store.identity != identity:
+            store = self.stores[name] = PatchStore(
+                    os.path.join(self.path, name), identity, shape, dtype,
+                    self.chunk_size)
+        return store
+
+    def flush(self):
+        """Write all stores to disk"""
+
+        for store in self.stores.values():
+            store.flush()
+
+
+class BlockCache(object):
+
+    def __init__(self, max_bytes=256*2**20):
+        """Bounded LRU cache of decoded raster blocks
+
+        Windows are assembled from whole blocks of the dataset's internal
+        tiling, so overlapping samples decode each block once. Blocks are
+        evicted least recently used first once max_bytes is exceeded.
+
+        Args:
+          max_bytes (int): memory budget for cached blocks
+        """
+
+        self.max_bytes = max_bytes
+        self.blocks = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """Drop cached blocks so the cache can be pickled"""
+
+        state = self.__dict__.copy()
+        state['blocks'] = collections.OrderedDict()
+        state['nbytes'] = 0
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def clear(self):
+        """Remove all blocks and reset counters"""
+
+        with self.lock:
+            self.blocks.clear()
+            self.nbytes = self.hits = self.misses = self.evictions = 0
+
+    def _token(self, src, bands):
+        """identify the dataset contents independent of the handle"""
+
+        return (src.name, tuple(bands), src.width, src.height,
+                tuple(src.transform)[:6], str(src.crs),
+                str(getattr(src, 'resampling', None)))
+
+    def _block(self, src, key, bands, row, col, shape):
+        """return a cached block, reading it on a miss"""
+
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        bh, bw = shape
+        window = Window(col*bw, row*bh, min(bw, src.width - col*bw),
+                min(bh, src.height - row*bh))
+        block = src.read(indexes=bands, window=window)
+
+        with self.lock:
+            if key not in self.blocks:
+                self.blocks[key] = block
+                self.nbytes += block.nbytes
+            while self.nbytes > self.max_bytes and len(self.blocks) > 1:
+                _, old = self.blocks.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+        return block
+
+    def read(self, src, indexes, window, out, resampling=None):
+        """Read window into out assembling it from cached blocks
+
+        Windows that extend past the dataset or need resampling to fit
+        out are read directly.
+
+        Args:
+          src (rasterio): data source opened with rasterio
+          indexes (int|[int]): raster band (int) or bands ([int,...])
+          window (tuple): (col_off, row_off, width, height)
+          out (ndarray): band first array receiving the window
+          resampling (Resampling): used when the window does not fit out
+        """
+
+        col, row, width, height = [int(v) for v in window]
+        if (out.shape[-2:] != (height, width) or row < 0 or col < 0
+                or row + height > src.height or col + width > src.width):
+            kwargs = dict(resampling=resampling) if resampling else {}
+            src.read(indexes=indexes, window=Window(col, row, width, height),
+                    out=out, **kwargs)
+            return
+
+        bands = [indexes] if isinstance(indexes, int) else list(indexes)
+        dst = out[None] if out.ndim == 2 else out
+        shape = src.block_shapes[0]
+        token = self._token(src, bands)
+        bh, bw = shape
+
+        for r in range(row // bh, (row + height - 1) // bh + 1):
+            r0, r1 = max(row, r*bh), min(row + height, (r+1)*bh)
+            for c in range(col // bw, (col + width - 1) // bw + 1):
+                c0, c1 = max(col, c*bw), min(col + width, (c+1)*bw)
+                block = self._block(src, token + (r, c), bands, r, c, shape)
+                dst[:, r0-row:r1-row, c0-col:c1-col] = \
+                        block[:, r0-r*bh:r1-r*bh, c0-c*bw:c1-c*bw]
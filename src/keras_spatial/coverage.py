@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Low resolution index of valid (not nodata) coverage used to drop samples
+that are mostly nodata before any full resolution read.
+"""
+
+import logging
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.transform import Affine
+from rasterio.windows import Window
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+class CoverageIndex(object):
+
+    def __init__(self, fraction, transform, crs=None):
+        """Fraction of valid pixels in each cell of a coarse grid
+
+        Args:
+          fraction (ndarray): (rows, cols) valid fraction between 0 and 1
+          transform (Affine): transform of the coarse grid
+          crs (CRS): coordinate reference system of the grid
+        """
+
+        self.fraction = np.asarray(fraction, dtype=np.float32)
+        self.transform = transform
+        self.crs = crs
+
+        # summed area table, so the mean over any window is four lookups
+        self.sat = np.zeros((self.fraction.shape[0] + 1,
+                self.fraction.shape[1] + 1))
+        self.sat[1:, 1:] = self.fraction.cumsum(0).cumsum(1)
+
+    @classmethod
+    def from_source(cls, src, indexes=None, factor=None, size=4096,
+            strip_pixels=2**24):
+        """Build the index from the mask of a raster
+
+        The mask is read at full resolution in strips of whole index rows
+        and each cell is the mean of its valid pixels, so a cell is 1
+        only when every pixel in it is valid. Cells past the raster edge
+        count only their pixels inside it.
+
+        Args:
+          src (rasterio dataset): the source raster
+          indexes (int|[int]): bands that must all be valid (default=all)
+          factor (int): source pixels per index cell along each axis
+          size (int): largest index dimension used when factor is unset
+          strip_pixels (int): approximate pixels read at a time
+
+        Returns:
+          (CoverageIndex)
+        """
+
+        if factor is None:
+            factor = 1
+            while max(src.width, src.height) / factor > size:
+                factor *= 2
+        if indexes is None:
+            indexes = src.indexes
+        bands = [indexes] if isinstance(indexes, int) else list(indexes)
+
+        rows = max(1, int(np.ceil(src.height / factor)))
+        cols = max(1, int(np.ceil(src.width / factor)))
+        _logger.info('building %dx%d coverage index for %s', cols, rows,
+                src.name)
+
+        # each strip holds about strip_pixels pixels, padding the
+        # right and bottom edges to whole cells
+        strip = max(1, strip_pixels // (cols * factor * factor))
+        valid = np.zeros((rows, cols))
+        count = np.zeros((rows, cols))
+        for row in range(0, rows, strip):
+            r0 = row * factor
+            height = min((row + strip) * factor, src.height) - r0
+            masks = src.read_masks(bands, window=Window(0, r0, src.width,
+                    height))
+            n = -(-height // factor)
+            pad = ((0, n * factor - height), (0, cols * factor - src.width))
+            mask = np.pad(masks.min(axis=0) > 0, pad)
+            inside = np.pad(np.ones((height, src.width), dtype=bool), pad)
+            shape = (n, factor, cols, factor)
+            valid[row:row+n] = mask.reshape(shape).sum(axis=(1, 3))
+            count[row:row+n] = inside.reshape(shape).sum(axis=(1, 3))
+
+        transform = src.transform * Affine.scale(factor, factor)
+        return cls(valid / count, transform, src.crs)
+
+    def valid_fraction(self, bounds):
+        """Return the approximate fraction of valid pixels in each sample
+
+        Every index cell touched by a sample counts fully, so the result
+        is exact only for samples aligned to the index grid. Parts of a
+        sample outside the index count as nodata.
+
+        Args:
+          bounds (ndarray): (N,4) sample bounds in the index crs
+
+        Returns:
+          (ndarray): (N,) fractions between 0 and 1
+        """
+
+        bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+        inv = ~self.transform
+        cols0, rows0 = inv * (bounds[:, 0], bounds[:, 3])
+        cols1, rows1 = inv * (bounds[:, 2], bounds[:, 1])
+        cols0, cols1 = np.minimum(cols0, cols1), np.maximum(cols0, cols1)
+        rows0, rows1 = np.minimum(rows0, rows1), np.maximum(rows0, rows1)
+
+        # whole cells covered, with a small tolerance for aligned edges
+        c0 = np.floor(cols0 + 1e-6).astype(np.int64)
+        c1 = np.maximum(np.ceil(cols1 - 1e-6).astype(np.int64), c0 + 1)
+        r0 = np.floor(rows0 + 1e-6).astype(np.int64)
+        r1 = np.maximum(np.ceil(rows1 - 1e-6).astype(np.int64), r0 + 1)
+        area = (c1 - c0) * (r1 - r0)
+
+        rows, cols = self.fraction.shape
+        c0, c1 = np.clip(c0, 0, cols), np.clip(c1, 0, cols)
+        r0, r1 = np.clip(r0, 0, rows), np.clip(r1, 0, rows)
+        valid = (self.sat[r1, c1] - self.sat[r0, c1] - self.sat[r1, c0]
+                + self.sat[r0, c0])
+        return valid / area
+
+    def filter(self, dataframe, threshold=0.5):
+        """Return the samples with at most threshold nodata
+
+        Args:
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          threshold (float): largest nodata fraction kept, 0 keeps only
+                  samples without nodata (default=0.5)
+
+        Returns:
+          (GeoDataFrame): subset of dataframe
+        """
+
+        df = dataframe
+        if self.crs and df.crs and CRS.from_user_input(df.crs) != self.crs:
+            df = df.to_crs(self.crs)
+        fraction = self.valid_fraction(df.geometry.values.bounds)
+        keep = 1.0 - fraction <= threshold + 1e-6
+        _logger.info('kept %d of %d samples', keep.sum(), len(keep))
+        return dataframe[keep]
+
+    def save(self, path):
+        """Write the index to a .npz file
+
+        Args:
+          path (str): file path
+        """
+
+        np.savez(path, fraction=self.fraction,
+                transform=np.array(tuple(self.transform)[:6]),
+                crs=self.crs.to_wkt() if self.crs else '')
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save
+
+        Args:
+          path (str): file path
+
+        Returns:
+          (CoverageIndex)
+        """
+
+        with np.load(path) as f:
+            crs = str(f['crs'])
+            return cls(f['fraction'], Affine(*f['transform']),
+                    CRS.from_wkt(crs) if crs else None)
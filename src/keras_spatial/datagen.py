@@ -2,23 +2,165 @@
 # -*- coding: utf-8 -*-
 
 import collections
+import copy
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import rasterio
 from rasterio.vrt import WarpedVRT
 from rasterio.warp import Resampling
 import geopandas as gpd
+import pandas as pd
 import numpy as np
 
 import keras_spatial.grid as grid
+import keras_spatial.samples as samples
+from keras_spatial.cache import PatchCache, BlockCache
+from keras_spatial.coverage import CoverageIndex
+from keras_spatial.overview import open_level, best_level, decimation
+from keras_spatial.overview import overview_cache
 
 import logging
 log = logging.getLogger(__name__)
 
+def bounds_to_windows(transform, bounds):
+    """Convert sample bounds to pixel windows with one inverse transform
+
+    Args:
+      transform (Affine): raster transform
+      bounds (ndarray): (N,4) array of (minx, miny, maxx, maxy)
+
+    Returns:
+      (ndarray): (N,4) int array of (col_off, row_off, width, height)
+    """
+
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    rows, cols = rasterio.transform.rowcol(transform,
+            np.concatenate((bounds[:,0], bounds[:,2])),
+            np.concatenate((bounds[:,1], bounds[:,3])))
+    rows, cols = np.asarray(rows), np.asarray(cols)
+
+    n = len(bounds)
+    left, bot, right, top = cols[:n], rows[:n], cols[n:], rows[n:]
+    return np.stack((left, top, right-left, bot-top), axis=1)
+
+
+def prefetch_iterator(iterable, size):
+    """Iterate in a background thread keeping up to size items ready
+
+    Items are produced on a daemon thread and handed over through a
+    bounded queue. Closing (or garbage collecting) the returned generator
+    stops the thread and closes the underlying iterator. Exceptions
+    raised while producing are re-raised in the consumer.
+
+    Args:
+      iterable (iterable): items to produce
+      size (int): maximum number of items produced ahead
+
+    Returns:
+      Iterator
+    """
+
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(iterator):
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    break
+            else:
+                put((done, None))
+        except BaseException as e:
+            put((None, e))
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, args=(iter(iterable),),
+            daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = items.get()
+            if exc is not None:
+                raise exc
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ReaderPool(object):
+
+    def __init__(self, acquire, release, workers):
+        """Thread pool where every thread reads from its own raster handle
+
+        GDAL dataset handles are not thread-safe so each worker thread
+        lazily checks out a dataset the first time it is used and keeps
+        it for the life of the pool.
+
+        Args:
+          acquire (function): returns a (token, dataset) checked out for
+                  a single thread
+          release (function): called with every token when the pool is
+                  closed
+          workers (int): number of threads
+        """
+
+        self.acquire = acquire
+        self.release = release
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers)
+        self.local = threading.local()
+        self.tokens = []
+        self.lock = threading.Lock()
+
+    def _src(self):
+        src = getattr(self.local, 'src', None)
+        if src is None:
+            token, src = self.acquire()
+            self.local.src = src
+            with self.lock:
+                self.tokens.append(token)
+        return src
+
+    def map(self, func, *iterables):
+        """Call func(src, *args) on the pool, returning results in order"""
+
+        return list(self.executor.map(lambda *args: func(self._src(), *args),
+                *iterables))
+
+    def close(self):
+        """Wait for pending reads and release all thread datasets"""
+
+        self.executor.shutdown()
+        for token in self.tokens:
+            self.release(token)
+        self.tokens = []
+
+
 class SpatialDataGenerator(object):
 
     def __init__(self, source=None, indexes=None, 
             width=0, height=0, batch_size=32,
             crs=None, interleave='pixel', resampling=Resampling.nearest,
-            preprocess=None):
+            preprocess=None, workers=1, cache=None, block_cache=None,
+            overviews=True, overview_cache=None, batch_preprocess=None,
+            halo=0):
         """
 
         Args:
@@ -32,9 +174,29 @@ class SpatialDataGenerator(object):
           interleave (str): type of interleave, 'pixel' or 'band'
           preprocess (tuple(str, func, list, dict) | list(tuples)): one or
                    more callbacks to each sample during batch creation
+          workers (int): number of threads reading windows in parallel,
+                   each with its own raster handle (default=1)
+          cache (str|PatchCache): optional on-disk patch cache, or its
+                   directory, reused across epochs
+          block_cache (int|BlockCache): optional in-memory cache of
+                   decoded raster blocks, or its size in bytes
+          overviews (bool): read coarse samples from the best source
+                   overview level (default=True)
+          overview_cache (str): optional directory where overviews are
+                   built for sources without them
+          batch_preprocess (tuple(str, func, list, dict) | list(tuples)):
+                   one or more callbacks to each batch array
+          halo (int): extra pixels read around each sample for the
+                   callbacks and cropped afterwards (default=0)
         """
 
         self.src = None
+        self._lock = threading.Lock()
+        self._vrts = collections.OrderedDict()
+        self._token = 0
+        self._levels = {}
+        self._coverage = None
+        self.max_vrts = 4
         if source: 
             self.source = source
         if indexes is not None:
@@ -45,19 +207,214 @@ class SpatialDataGenerator(object):
         self.crs=crs
         self.resampling = resampling
         self.interleave = interleave
+        self.workers = workers
+        self.cache = PatchCache(cache) if isinstance(cache, str) else cache
+        if isinstance(block_cache, int):
+            block_cache = BlockCache(block_cache)
+        self.block_cache = block_cache
+        self.overviews = overviews
+        self.overview_cache = overview_cache
+        self.halo = halo
 
-        self.preprocess = collections.OrderedDict()
+        self.preprocess = self._callbacks(preprocess)
+        self.batch_preprocess = self._callbacks(batch_preprocess)
+
+    @staticmethod
+    def _callbacks(preprocess):
+        """return name: (func, args, kwargs) for callback tuples"""
+
+        callbacks = collections.OrderedDict()
         if preprocess and isinstance(preprocess[0], str):
-            self.preprocess[preprocess[0]] = preprocess[1:]
-        elif preprocess:
-            for cb in preprocess:
-                self.preprocess[cb[0]] = cb[1:]
+            preprocess = [preprocess]
+        for cb in preprocess or []:
+            func, args, kwargs = (tuple(cb[1:]) + ((), {}))[:3]
+            callbacks[cb[0]] = (func, tuple(args), dict(kwargs))
+        return callbacks
+
+    def __getstate__(self):
+        """Drop the open dataset so the generator can be pickled"""
+
+        state = self.__dict__.copy()
+        state['src'] = None
+        state['_vrts'] = collections.OrderedDict()
+        state['_levels'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Reopen the source after unpickling"""
+
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if getattr(self, '_source', None):
+            self.source = self._source
+
+    def worker_copy(self):
+        """Return a copy of the generator for another thread or process
+
+        The copy opens its own dataset and does not use the patch cache,
+        as patch stores are not safe for concurrent writers.
+
+        Returns:
+          (SpatialDataGenerator)
+        """
+
+        sdg = copy.deepcopy(self)
+        sdg.cache = None
+        return sdg
+
+    def map_parts(self, func, dataframe, workers=1):
+        """Apply func to contiguous parts of dataframe on threads
+
+        func(part, sdg) is called once per part, with a worker_copy of
+        this generator when there is more than one part and with the
+        generator itself otherwise.
+
+        Args:
+          func (function): called with a dataframe part and a generator
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          workers (int): number of parts and threads (default=1)
+
+        Returns:
+          (list): results of func in dataframe order
+        """
+
+        parts = np.array_split(np.arange(len(dataframe)),
+                max(1, min(workers, len(dataframe))))
+        if len(parts) == 1:
+            return [func(dataframe, self)]
+        with ThreadPoolExecutor(len(parts)) as executor:
+            return list(executor.map(lambda p: func(dataframe.iloc[p],
+                    self.worker_copy()), parts))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close pooled VRTs and the source"""
+
+        self._close()
 
     def _close(self):
+        with self._lock:
+            for entry in self._vrts.values():
+                self._close_entry(entry)
+            self._vrts.clear()
+            for src in self._levels.values():
+                src.close()
+            self._levels.clear()
         if self.src:
             self.src.close()
             self.src = None
 
+    def _acquire_vrt(self, options, level=None):
+        """Check out a pooled dataset for reading, creating it if needed
+
+        Datasets are keyed by their source level and, for warped reads,
+        the VRT options, so repeated epochs and dataframes with the same
+        grid reuse the warper and its block cache. GDAL handles are not
+        thread safe, so a checked out dataset is used by its caller
+        alone and has its own source handle. Callers must release the
+        returned token when done.
+
+        Args:
+          options (dict): WarpedVRT options, None to read level directly
+          level (tuple): level returned by _level
+
+        Returns:
+          (tuple(int, dataset)): token and dataset
+        """
+
+        key = (repr(level), None if options is None else
+                tuple((k, repr(v)) for k, v in sorted(options.items())))
+        with self._lock:
+            for token, entry in self._vrts.items():
+                if entry[2] == key and not entry[1]:
+                    entry[1] = True
+                    self._vrts.move_to_end(token)
+                    return token, entry[0]
+
+        src = open_level(*level) if level else rasterio.open(self.source)
+        if options is None:
+            entry = [src, True, key, None]
+        else:
+            entry = [WarpedVRT(src, **options), True, key, src]
+
+        with self._lock:
+            self._token += 1
+            self._vrts[self._token] = entry
+            self._evict_vrts()
+            return self._token, entry[0]
+
+    def _release_vrt(self, token):
+        with self._lock:
+            entry = self._vrts.get(token)
+            if entry:
+                entry[1] = False
+            self._evict_vrts()
+
+    def _level(self, options):
+        """Return the (path, overview index) samples should be read from
+
+        The coarsest overview whose resolution is not coarser than the
+        samples is used, building a local overview cache first when the
+        source has no overviews and overview_cache is set. None is
+        returned for the full resolution source.
+        """
+
+        if not self.overviews:
+            return None
+        factor = decimation(self.src, options)
+        if factor < 2:
+            return None
+
+        band = self.indexes if isinstance(self.indexes, int) \
+                else self.indexes[0]
+        factors = self.src.overviews(band)
+        if factors:
+            level = best_level(factors, factor)
+            return None if level is None else (self.source, level)
+
+        if self.overview_cache:
+            path = overview_cache(self.src, self.overview_cache,
+                    self.resampling)
+            src = self._open_level((path, None))
+            level = best_level([2] + [2*f for f in src.overviews(band)],
+                    factor)
+            return (path, None if level == 0 else level - 1)
+
+        return None
+
+    def _open_level(self, level):
+        """Return the pooled dataset for a level returned by _level"""
+
+        if level is None:
+            return self.src
+        with self._lock:
+            if level not in self._levels:
+                self._levels[level] = open_level(*level)
+            return self._levels[level]
+
+    def _evict_vrts(self):
+        """close least recently used datasets that are not in use"""
+
+        # reader threads and the caller each hold a dataset per grid
+        keep = max(self.max_vrts, self.workers + 1)
+        idle = [t for t, entry in self._vrts.items() if not entry[1]]
+        for token in idle[:max(0, len(self._vrts) - keep)]:
+            self._close_entry(self._vrts.pop(token))
+
+    @staticmethod
+    def _close_entry(entry):
+        """close a pooled dataset and its own source handle"""
+
+        for handle in (entry[0], entry[3]):
+            if handle is not None:
+                handle.close()
+
     @property
     def extent(self):
         if self.src:
@@ -70,7 +427,8 @@ class SpatialDataGenerator(object):
         """Return dict of parameters that are likely to re-used."""
 
         return dict(width=self.width, height=self.height, crs=self.crs, 
-                interleave=self.interleave, resampling=self.resampling)
+                interleave=self.interleave, resampling=self.resampling,
+                halo=self.halo)
 
     @profile.setter
     def profile(self, profile):
@@ -81,6 +439,7 @@ class SpatialDataGenerator(object):
         self.crs = profile['crs']
         self.interleave = profile['interleave']
         self.resampling = profile['resampling']
+        self.halo = profile.get('halo', 0)
 
     @property
     def crs(self):
@@ -109,6 +468,7 @@ class SpatialDataGenerator(object):
 
         self._close()
         self._source = source
+        self._coverage = None
 
         self.src = rasterio.open(source)
 
@@ -116,6 +476,19 @@ class SpatialDataGenerator(object):
         if idx is None:
             self.indexes = list(range(1, self.src.count+1))
 
+    def _sample_dims(self, width, height, units):
+        """Return sample size in map units."""
+
+        if not self.src:
+            raise RuntimeError('source not set or failed to open')
+
+        if units == 'pixels':
+            return width * self.src.res[0], height * self.src.res[1]
+        elif units == 'native':
+            return width, height
+        else:
+            raise ValueError('units must be "native" or "pixels"')
+
     def regular_grid(self, width, height, overlap=0.0, units='native'):
         """Create a dataframe that defines the a regular grid of samples.
 
@@ -136,20 +509,37 @@ class SpatialDataGenerator(object):
           (GeoDataframe)
         """
 
-        if not self.src:
-            raise RuntimeError('source not set or failed to open')
-
-        if units == 'pixels':
-            dims = width * self.src.res[0], height * self.src.res[1]
-        elif units == 'native':
-            dims = width, height
-        else:
-            raise ValueError('units must be "native" or "pixels"')
+        dims = self._sample_dims(width, height, units)
 
         gdf = grid.regular_grid(*self.src.bounds, *dims, overlap=overlap)
         gdf.crs = self.src.crs
         return gdf
 
+    def regular_grid_chunks(self, width, height, overlap=0.0,
+            units='native', chunksize=100000):
+        """Create an iterator of dataframes that together define a regular
+        grid of samples.
+
+        Equivalent to regular_grid but the grid is produced lazily in
+        row-major chunks so extents too large to hold in memory can be
+        passed directly to flow_from_dataframe.
+
+        Args:
+          width (int): sample size 
+          height (int): sample size
+          units (str): units applied to sample sizes ('native' or 'pixels')
+          overlap (float): percentage overlap (default=0.0)
+          chunksize (int): maximum number of samples per dataframe
+
+        Returns:
+          Iterator[GeoDataframe]
+        """
+
+        dims = self._sample_dims(width, height, units)
+
+        return samples.regular_grid_chunks(*self.src.bounds, *dims,
+                overlap=overlap, crs=self.src.crs, chunksize=chunksize)
+
     def random_grid(self, width, height, count, units='native'):
         """Create a dataframe that defines a random set of samples.
 
@@ -169,26 +559,21 @@ class SpatialDataGenerator(object):
           (GeoDataframe)
         """
 
-        if not self.src:
-            raise RuntimeError('source not set or failed to open')
-
-        if units == 'pixels':
-            dims = width * self.src.res[0], height * self.src.res[1]
-        elif units == 'native':
-            dims = width, height
-        else:
-            raise ValueError('units must be "native" or "pixels"')
+        dims = self._sample_dims(width, height, units)
 
         gdf = grid.random_grid(*self.src.bounds, *dims, count)
         gdf.crs = self.src.crs
         return gdf
 
-    def get_batch(self, src, geometries):
+    def get_batch(self, src, geometries, out=None):
         """Get batch of patches from source raster
 
         Args:
           src (rasterio): data source opened with rasterio
-          geometries (GeoSeries): boundaries to extract from raster
+          geometries (GeoSeries|ndarray): boundaries to extract from raster
+                  or an (N,4) array of (minx, miny, maxx, maxy)
+          out (ndarray): optional preallocated batch array (see
+                  allocate_batch), patches are read directly into it
 
         Returns:
           (numpy array)
@@ -197,25 +582,169 @@ class SpatialDataGenerator(object):
         a consistent grid.
         """
 
-        batch = []
-        for bounds in geometries.bounds.itertuples():
-            bot, left = src.index(bounds[1], bounds[2])
-            top, right = src.index(bounds[3], bounds[4])
-            window = rasterio.windows.Window(left, top, right-left, bot-top)
-            batch.append(src.read(indexes=self.indexes, window=window))
-            if self.interleave == 'pixel' and len(batch[-1].shape) == 3:
-                batch[-1] = np.moveaxis(batch[-1], 0, -1)
-            for func,args,kwargs in self.preprocess.values():
-                batch[-1] = func(batch[-1], *args, **kwargs)
+        if isinstance(geometries, gpd.GeoSeries):
+            geometries = geometries.values.bounds
+
+        return self.read_windows(src, bounds_to_windows(src.transform,
+                geometries), out=out)
+
+    def allocate_batch(self, count, width, height, dtype=None):
+        """Allocate an empty batch array matching indexes and interleave
+
+        Args:
+          count (int): number of samples
+          width (int): sample width in pixels
+          height (int): sample height in pixels
+          dtype (dtype): array type (default=source band type)
+
+        Returns:
+          (numpy array)
+        """
+
+        if dtype is None:
+            if not self.src:
+                raise RuntimeError('source not set or failed to open')
+            idx = self.indexes
+            band = idx if isinstance(idx, int) else idx[0]
+            dtype = self.src.dtypes[band - 1]
 
-        return np.stack(batch)
+        if isinstance(self.indexes, int):
+            shape = (count, height, width)
+        elif self.interleave == 'pixel':
+            shape = (count, height, width, len(self.indexes))
+        else:
+            shape = (count, len(self.indexes), height, width)
+
+        return np.empty(shape, dtype=dtype)
+
+    def read_windows(self, src, windows, out=None, pool=None, store=None,
+            bounds=None, pads=None, index=None):
+        """Read a batch of patches from precomputed pixel windows
+
+        Each window is read directly into its slice of the batch array,
+        windows that do not match the batch sample size are resampled
+        to fit.
+
+        Args:
+          src (rasterio): data source opened with rasterio
+          windows (ndarray): (N,4) array of (col_off, row_off, width, height)
+          out (ndarray): optional preallocated batch array with N samples
+          pool (ReaderPool): optional pool that splits the reads across
+                  threads, each reading from its own copy of src
+          store (PatchStore): optional patch cache, only samples missing
+                  from it are read and are then added to it
+          bounds (ndarray): (N,4) sample bounds used as the cache key
+          pads (ndarray): optional (N,4) (top, bottom, left, right) pixels
+                  of each sample outside its window, filled by reflection
+          index ((int, int)): optional (epoch, batch number) passed to
+                  batch callbacks that set an indexed attribute
+
+        Returns:
+          (numpy array)
+        """
+
+        if out is None:
+            out = self.allocate_batch(len(windows), windows[0][2],
+                    windows[0][3], dtype=src.dtypes[0])
+        elif len(out) != len(windows):
+            raise ValueError('out must have one sample per window')
+
+        if store is not None:
+            idx = store.get(bounds, out)
+        else:
+            idx = np.arange(len(windows))
+
+        if pool and len(idx) > 1:
+            # each thread writes its own samples so batch order is kept
+            pool.map(lambda src, part: self._read_into(src, windows[part],
+                    [out[i] for i in part],
+                    pads=None if pads is None else pads[part]),
+                    np.array_split(idx, min(pool.workers, len(idx))))
+        elif len(idx) == len(windows):
+            self._read_into(src, windows, out, pads=pads)
+        else:
+            self._read_into(src, windows[idx], [out[i] for i in idx],
+                    pads=None if pads is None else pads[idx])
 
-    def flow_from_dataframe(self, dataframe, width=0, height=0, batch_size=0):
+        if store is not None and len(idx):
+            store.put(bounds[idx], out[idx])
+
+        if self.preprocess:
+            out = np.stack([self._preprocess(arr) for arr in out])
+
+        for func,args,kwargs in self.batch_preprocess.values():
+            if index is not None and getattr(func, 'indexed', False):
+                kwargs = dict(kwargs, index=index)
+            out = func(out, *args, **kwargs)
+        return out
+
+    def _read_into(self, src, windows, out, interleave=None, pads=None):
+        """read each window into the matching sample of out"""
+
+        interleave = interleave if interleave else self.interleave
+        for i, (arr, window) in enumerate(zip(out, windows)):
+            # pixel interleave is read through a band-first view
+            if arr.ndim == 3 and interleave == 'pixel':
+                arr = arr.transpose(2, 0, 1)
+            pad = None if pads is None or not pads[i].any() else pads[i]
+            inner = arr
+            if pad is not None:
+                top, bottom, left, right = pad
+                inner = arr[..., top:arr.shape[-2]-bottom,
+                        left:arr.shape[-1]-right]
+            if self.block_cache is not None:
+                self.block_cache.read(src, self.indexes, window, inner,
+                        resampling=self.resampling)
+            else:
+                src.read(indexes=self.indexes, out=inner,
+                        window=rasterio.windows.Window(*window),
+                        resampling=self.resampling)
+            if pad is not None:
+                arr[...] = np.pad(inner, [(0, 0)] * (arr.ndim - 2) +
+                        [(top, bottom), (left, right)], mode='symmetric')
+
+    def _preprocess(self, arr):
+        """apply preprocess callbacks to a single sample"""
+
+        for func,args,kwargs in self.preprocess.values():
+            arr = func(arr, *args, **kwargs)
+        return arr
+
+    def flow_from_dataframe(self, dataframe, width=0, height=0, batch_size=0,
+            buffers=0, prefetch=0, order=None, order_window=16,
+            epoch=None):
         """extracts data from source based on sample extents
 
+        By default every batch is a newly allocated array. When buffers
+        is set, batches are read into a ring of that many preallocated
+        arrays which are reused cyclically, a yielded batch is
+        overwritten once buffers more batches have been requested and
+        must be copied if it is kept longer.
+
+        When prefetch is set, up to that many batches are read ahead on
+        a background thread so raster I/O overlaps with model compute.
+
+        When order is set, samples are reordered within consecutive
+        windows of order_window batches so each batch covers a compact
+        region of the source and reuses decoded blocks. The order of the
+        windows, and so the randomness of a shuffled dataframe across
+        the epoch, is kept. See sample_order for the resulting positions.
+
+        Batch callbacks that set an indexed attribute, such as
+        GeometricAugmenter, receive the (epoch, batch number) of every
+        batch as index, so random augmentation follows the batch rather
+        than the number of calls.
+
         Args:
-          dataframe (geodataframe): dataframe with spatial extents
+          dataframe (geodataframe|iterable): dataframe with spatial extents
+                  or an iterable of dataframes (see regular_grid_chunks)
           batch_size (int): batch size to process (default=32)
+          buffers (int): number of recycled batch arrays (default=0)
+          prefetch (int): number of batches read ahead (default=0)
+          order (str): 'hilbert', 'zorder' or 'block' (default=None)
+          order_window (int): batches per reordering window (default=16)
+          epoch (int): epoch number passed to indexed callbacks
+                  (default=None, callbacks keep their own epoch)
 
         Returns:
           Iterator[ndarray]
@@ -229,10 +758,137 @@ class SpatialDataGenerator(object):
         if batch_size < 1:
             raise ValueError('batch size must be specified')
 
+        if prefetch > 0 and 0 < buffers < prefetch + 2:
+            raise ValueError('buffers must exceed prefetch by at least 2')
+        if order not in (None, 'hilbert', 'zorder', 'block'):
+            raise ValueError('order must be "hilbert", "zorder" or "block"')
+        window = order_window * batch_size if order else None
+
+        if buffers > 0:
+            ring = itertools.cycle([self.allocate_batch(batch_size,
+                    width + 2*self.halo, height + 2*self.halo)
+                    for _ in range(buffers)])
+        else:
+            ring = None
+
+        index = zip(itertools.repeat(epoch), itertools.count())
+        batches = self._batches(dataframe, width, height, batch_size, ring,
+                order, window, index)
+        if prefetch > 0:
+            batches = prefetch_iterator(batches, prefetch)
+        yield from batches
+
+    def _batches(self, dataframe, width, height, batch_size, ring=None,
+            order=None, window=0, index=None):
+        """extracts batches from a dataframe or iterable of dataframes"""
+
+        args = (batch_size, ring, order, window, index)
+        if isinstance(dataframe, gpd.GeoDataFrame):
+            yield from self._flow(dataframe, width, height, *args)
+            return
+
+        # carry partial batches into the next chunk so batch sizes are
+        # independent of the chunk size
+        remainder = None
+        for df in dataframe:
+            if remainder is not None and len(remainder):
+                df = pd.concat([remainder, df])
+            count = len(df) - len(df) % batch_size
+            if count:
+                yield from self._flow(df.iloc[:count], width, height, *args)
+            remainder = df.iloc[count:]
+
+        if remainder is not None and len(remainder):
+            yield from self._flow(remainder, width, height, *args)
+
+    def sample_order(self, dataframe, width=0, height=0, order='hilbert',
+            window=0):
+        """Return the order flow_from_dataframe reads samples in
+
+        Args:
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          width (int): sample width in pixels (default=self.width)
+          height (int): sample height in pixels (default=self.height)
+          order (str): 'hilbert', 'zorder' or 'block'
+          window (int): samples per reordering window (default=0 for all)
+
+        Returns:
+          (ndarray): positional indexes into dataframe
+        """
+
+        width = width if width else self.width
+        height = height if height else self.height
+        src = None
+        if order == 'block':
+            src = self._open_level(self._level(
+                    self.vrt_options(dataframe, width, height)))
+        return self._order(dataframe.geometry.values.bounds, order, window,
+                src, dataframe.crs)
+
+    def _order(self, bounds, order, window, src=None, crs=None):
+        """sort samples by curve position or by the source block read"""
+
+        if order == 'block':
+            # block keys come from the source grid so bounds in another
+            # crs are reprojected by their corners first
+            if crs and src.crs and crs != src.crs:
+                xs = bounds[:, [0, 2, 0, 2]].ravel()
+                ys = bounds[:, [1, 1, 3, 3]].ravel()
+                xs, ys = rasterio.warp.transform(crs, src.crs, xs, ys)
+                xs = np.reshape(xs, (-1, 4))
+                ys = np.reshape(ys, (-1, 4))
+                bounds = np.stack([xs.min(axis=1), ys.min(axis=1),
+                        xs.max(axis=1), ys.max(axis=1)], axis=1)
+            bh, bw = src.block_shapes[0]
+            windows = bounds_to_windows(src.transform, bounds)
+            rows = np.clip(windows[:,1], 0, src.height - 1) // bh
+            cols = np.clip(windows[:,0], 0, src.width - 1) // bw
+            keys = rows * -(-src.width // bw) + cols
+        else:
+            keys = samples.curve_keys((bounds[:,0] + bounds[:,2]) / 2.0,
+                    (bounds[:,1] + bounds[:,3]) / 2.0, order)
+        return samples.window_order(keys, window)
+
+    def filter_nodata(self, dataframe, threshold=0.5, index=None):
+        """Drop samples that are mostly nodata without reading them
+
+        The nodata fraction of every sample is estimated from a coarse
+        CoverageIndex built from the source mask, which is also kept on
+        the generator for later calls.
+
+        Args:
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          threshold (float): largest nodata fraction kept (default=0.5)
+          index (CoverageIndex): optional precomputed index
+
+        Returns:
+          (GeoDataFrame): subset of dataframe
+        """
+
+        if index is None:
+            if self._coverage is None:
+                if not self.src:
+                    raise RuntimeError('source not set or failed to open')
+                self._coverage = CoverageIndex.from_source(self.src,
+                        self.indexes)
+            index = self._coverage
+        return index.filter(dataframe, threshold)
+
+    def vrt_options(self, df, width, height):
+        """Return WarpedVRT options that place samples on a common grid
+
+        Args:
+          df (GeoDataFrame): dataframe with spatial extents
+          width (int): sample width in pixels
+          height (int): sample height in pixels
+
+        Returns:
+          (dict): keyword arguments for WarpedVRT including transform
+        """
+
         # TODO should reprojection be handled here or externally?
         # TODO Is there equivelancy check for projections?
-        #df = dataframe.to_crs(self.crs) if self.crs else dataframe
-        df = dataframe
+        #df = df.to_crs(self.crs) if self.crs else df
 
         # TODO this finds the average sample area and computes the desired
         #  resolution based on it and sample size. Probably not what is
@@ -250,20 +906,242 @@ class SpatialDataGenerator(object):
         xres, yres = (maxx - minx) / width, (maxy - miny) / height
 
         minx, miny, maxx, maxy = df.total_bounds
-        width = (maxx - minx) / xres
-        height = (maxy - miny) / yres
+        vrt_width = (maxx - minx) / xres
+        vrt_height = (maxy - miny) / yres
         transform = rasterio.transform.from_origin(minx, maxy, xres, yres)
 
-        # use VRT to ensure correct projection and size
-        vrt = WarpedVRT(self.src, crs=df.crs, 
-                width=width, height=height,
-                transform=transform,
-                resampling=self.resampling)
+        return dict(crs=df.crs, width=vrt_width, height=vrt_height,
+                transform=transform, resampling=self.resampling)
+
+    def _halo_bounds(self, bounds, options):
+        """return sample bounds widened by the halo"""
 
-        for i in range(0, len(df), batch_size):
-            yield self.get_batch(vrt, df.iloc[i:i+batch_size]['geometry'])
+        if not self.halo:
+            return bounds
+        t = options['transform']
+        x, y = self.halo * abs(t.a), self.halo * abs(t.e)
+        return bounds + np.array([-x, -y, x, y])
 
-        vrt.close()
+    def _check_halo(self):
+        """reject batch callbacks that crop samples along with a halo"""
+
+        if not self.halo:
+            return
+        for name, (func, _, _) in self.batch_preprocess.items():
+            if getattr(func, 'crop', None):
+                raise ValueError('batch callback {} crops samples, which is '
+                        'not supported with halo, crop the yielded batches '
+                        'instead'.format(name))
+
+    def _halo_options(self, options):
+        """return VRT options widened so halos of edge samples lie on it"""
+
+        if not self.halo:
+            return options
+        t = options['transform']
+        x, y = self.halo * abs(t.a), self.halo * abs(t.e)
+        return dict(options, width=options['width'] + 2*self.halo,
+                height=options['height'] + 2*self.halo,
+                transform=rasterio.transform.from_origin(t.c - x, t.f + y,
+                abs(t.a), abs(t.e)))
+
+    def _windows(self, bounds, options, mode, src):
+        """pixel windows of samples and their halos on the read grid
+
+        Halos are clipped to the source rather than read as nodata, the
+        returned pads are the (top, bottom, left, right) sample pixels of
+        each halo outside the source, filled by reflection after reading.
+
+        Returns:
+          (tuple(ndarray, ndarray)): (N,4) windows and (N,4) pads or None
+        """
+
+        if mode == 'warp':
+            transform = options['transform']
+        else:
+            transform = src.transform
+        windows = bounds_to_windows(transform,
+                self._halo_bounds(bounds, options))
+        if not self.halo:
+            return windows, None
+
+        if mode == 'warp':
+            # footprint of the source on the VRT grid
+            footprint = rasterio.warp.transform_bounds(src.crs,
+                    options['crs'], *src.bounds)
+            col, row, w, h = bounds_to_windows(transform, footprint)[0]
+            lo, hi = np.array([col, row]), np.array([col + w, row + h])
+            kx = ky = 1
+        else:
+            lo, hi = np.zeros(2, dtype=int), np.array([src.width, src.height])
+            kx = int(round(options['transform'].a / src.transform.a))
+            ky = int(round(options['transform'].e / src.transform.e))
+
+        # only halo pixels are clipped, each a whole decimation step
+        windows = windows.copy()
+        pads = np.zeros_like(windows)
+        for axis, k in ((0, kx), (1, ky)):
+            off, size = windows[:, axis], windows[:, axis+2]
+            before = np.minimum(-(np.minimum(off - lo[axis], 0) // k),
+                    self.halo)
+            after = np.minimum(-(np.minimum(hi[axis] - off - size, 0) // k),
+                    self.halo)
+            windows[:, axis] = off + before * k
+            windows[:, axis+2] = size - (before + after) * k
+            pads[:, 2 - 2*axis] = before
+            pads[:, 3 - 2*axis] = after
+        return windows, pads
+
+    def _crop(self, arr, width, height):
+        """remove what is left of the halo from a batch after callbacks
+
+        Callbacks may use part of the halo, e.g. valid mode filters, or
+        change the band layout, so the sample axes are the first pair of
+        axes no smaller than the sample and no larger than with the halo.
+        """
+
+        h = self.halo
+        if not h:
+            return arr
+
+        def fits(shape):
+            return all(n <= d <= n + 2*h and (d - n) % 2 == 0
+                    for d, n in zip(shape, (height, width)))
+
+        pixel = arr.ndim == 4 and self.interleave == 'pixel'
+        if pixel and fits(arr.shape[1:3]):
+            axes = (1, 2)
+        elif fits(arr.shape[-2:]):
+            axes = (arr.ndim - 2, arr.ndim - 1)
+        elif arr.ndim >= 3 and fits(arr.shape[1:3]):
+            axes = (1, 2)
+        else:
+            raise ValueError('batch shape {} has no {}x{} sample axes'.format(
+                    arr.shape, height, width))
+
+        index = [slice(None)] * arr.ndim
+        for axis, n in zip(axes, (height, width)):
+            off = (arr.shape[axis] - n) // 2
+            index[axis] = slice(off, off + n)
+        return arr[tuple(index)]
+
+    def _flow(self, df, width, height, batch_size, ring=None, order=None,
+            window=0, index=None):
+        """extracts batches from a single dataframe"""
+
+        self._check_halo()
+
+        # use VRT to ensure correct projection and size unless the
+        # samples already lie on the source grid
+        options = self.vrt_options(df, width, height)
+        level = self._level(options)
+        src = self._open_level(level)
+        mode = self._read_mode(options, src)
+        log.info('reading %d samples using %s path from %s', len(df), mode,
+                src.name if level is None else level)
+        if mode == 'warp':
+            options = self._halo_options(options)
+
+        # all pixel windows are computed up front so each batch is
+        # only an array slice and the reads
+        bounds = df.geometry.values.bounds
+        if order:
+            bounds = bounds[self._order(bounds, order, window, src, df.crs)]
+        windows, pads = self._windows(bounds, options, mode, src)
+        token, src = self._acquire_vrt(options if mode == 'warp' else None,
+                level)
+
+        # reader threads check out their own pooled datasets, so their
+        # warpers and block caches also survive between epochs
+        pool = None
+        if self.workers > 1:
+            pool = ReaderPool(lambda: self._acquire_vrt(options
+                    if mode == 'warp' else None, level), self._release_vrt,
+                    self.workers)
+
+        # samples are read with the halo, callbacks see the halo and it
+        # is cropped from the yielded batch
+        width, height = width + 2*self.halo, height + 2*self.halo
+
+        store = None
+        if self.cache is not None:
+            sample = self.allocate_batch(0, width, height)
+            profile = dict(self.profile, width=width, height=height,
+                    crs=df.crs.to_wkt() if df.crs else None,
+                    indexes=self.indexes, level=level)
+            store = self.cache.store(self.source, profile, sample.shape[1:],
+                    sample.dtype)
+
+        try:
+            for i in range(0, len(df), batch_size):
+                count = min(batch_size, len(df) - i)
+                if ring:
+                    out = next(ring)[:count]
+                else:
+                    out = self.allocate_batch(count, width, height)
+                batch = self.read_windows(src, windows[i:i+batch_size],
+                        out=out, pool=pool, store=store,
+                        bounds=bounds[i:i+batch_size],
+                        pads=None if pads is None else pads[i:i+batch_size],
+                        index=next(index) if index else None)
+                yield self._crop(batch, width - 2*self.halo,
+                        height - 2*self.halo)
+        finally:
+            if pool:
+                pool.close()
+            if store is not None:
+                store.flush()
+            self._release_vrt(token)
+
+    def read_mode(self, dataframe, width=0, height=0):
+        """Return how samples from dataframe would be read
+
+        Args:
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          width (int): sample width in pixels (default=self.width)
+          height (int): sample height in pixels (default=self.height)
+
+        Returns:
+          (str): 'direct' for windowed reads of the source, 'decimate'
+                  for reads of the source downsampled by an integer
+                  factor or 'warp' for reads through a WarpedVRT
+        """
+
+        width = width if width else self.width
+        height = height if height else self.height
+        options = self.vrt_options(dataframe, width, height)
+        return self._read_mode(options,
+                self._open_level(self._level(options)))
+
+    def _read_mode(self, options, src=None):
+        """choose the cheapest way to read the VRT grid from the source
+
+        The VRT can be skipped when it shares the source crs, is aligned
+        to source pixels, lies within the source and has the source
+        resolution or an integer multiple of it.
+        """
+
+        src = src if src is not None else self.src
+        t = options['transform']
+        st = src.transform
+        if options['crs'] != src.crs or st.b != 0 or st.d != 0:
+            return 'warp'
+
+        def integer(v):
+            return abs(v - round(v)) < 1e-6
+
+        kx, ky = t.a / st.a, t.e / st.e
+        col, row = (t.c - st.c) / st.a, (t.f - st.f) / st.e
+        if not all(integer(v) for v in (kx, ky, col, row)) or \
+                round(kx) < 1 or round(ky) < 1:
+            return 'warp'
+
+        if round(col) < 0 or round(row) < 0 or \
+                round(col + options['width'] * kx) > src.width or \
+                round(row + options['height'] * ky) > src.height:
+            return 'warp'
+
+        return 'direct' if round(kx) == round(ky) == 1 else 'decimate'
 
     def add_preprocess_callback(self, name, func, *args, **kwargs):
         """add a callback function that is applied to every sample array
@@ -296,3 +1174,33 @@ class SpatialDataGenerator(object):
 
         del self.preprocess[name]
 
+    def add_batch_preprocess_callback(self, name, func, *args, **kwargs):
+        """add a callback function that is applied to every batch array
+
+        The callback receives the whole batch, e.g. (N,h,w,bands) with
+        pixel interleave, as its first argument so numpy operations run
+        once per batch instead of once per sample. Batch callbacks run
+        after any per-sample callbacks, in the order they were added.
+        The callback may modify the batch in place and must return it,
+        or a new array, when done.
+
+        ndarray = func(ndarray, *args, **kwargs)
+
+        Args:
+          name (str): name of the callback
+          func (function): function to be called
+          args (list): arguments to be passed to the callback
+          kwargs (dict): keyword arguments to be passed to callback
+        """
+
+        self.batch_preprocess[name] = (func, args, kwargs)
+
+    def del_batch_preprocess_callback(self, name):
+        """remove a batch callback function from processing list
+
+        Args:
+          name (str): name of callback to be removed
+        """
+
+        del self.batch_preprocess[name]
+
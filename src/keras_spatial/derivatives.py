@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Precompute terrain derivatives for a whole raster, once, into a tiled
+multiband GeoTIFF that can be sampled like any other source instead of
+recomputing derivatives for every, possibly overlapping, sample.
+"""
+
+import os
+import sys
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+from rasterio.enums import Resampling
+
+from keras_spatial import __version__
+from keras_spatial.augmentation import terrain_analysis
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+BANDS = ('elevation', 'slope', 'aspect', 'plan_curvature',
+        'profile_curvature', 'mean_curvature')
+
+def tile_windows(width, height, tilesize):
+    """Return the windows tiling a raster.
+
+    Args:
+      width (int): raster width in pixels
+      height (int): raster height in pixels
+      tilesize (int): tile width and height in pixels
+
+    Returns:
+      list(Window)
+    """
+
+    return [Window(col, row, min(tilesize, width - col),
+            min(tilesize, height - row))
+            for row in range(0, height, tilesize)
+            for col in range(0, width, tilesize)]
+
+
+def terrain_tile(source, window, band=1, dtype='float32'):
+    """Compute terrain derivatives for one tile of a raster.
+
+    The tile is read with a one pixel halo so derivatives are seamless
+    across tiles. At the raster edges the halo is filled symmetrically,
+    as terrain_analysis does for a whole raster. Elevation is nodata
+    where the source is, and the derivatives are nodata wherever the
+    3x3 neighbourhood they are computed from holds any nodata.
+
+    Args:
+      source (str): raster file path or URL
+      window (Window): tile window
+      band (int): elevation band
+      dtype (dtype): type used for the calculation and result
+
+    Returns:
+      (ndarray): (6, window.height, window.width) derivatives
+    """
+
+    with rasterio.open(source) as src:
+        c0, r0 = max(window.col_off - 1, 0), max(window.row_off - 1, 0)
+        c1 = min(window.col_off + window.width + 1, src.width)
+        r1 = min(window.row_off + window.height + 1, src.height)
+        arr = src.read(band, window=Window(c0, r0, c1 - c0, r1 - r0))
+        res, nodata = src.res, src.nodata
+
+    pad = ((1 - (window.row_off - r0),
+            1 - (r1 - window.row_off - window.height)),
+           (1 - (window.col_off - c0),
+            1 - (c1 - window.col_off - window.width)))
+    arr = np.pad(arr, pad, mode='symmetric')
+
+    size = (arr.shape[1] * res[0], arr.shape[0] * res[1])
+    result = terrain_analysis(arr, size, dtype=dtype)[:, 1:-1, 1:-1]
+    if nodata is not None:
+        if np.isnan(nodata):
+            invalid = np.isnan(arr)
+        else:
+            invalid = arr == nodata
+        h, w = result.shape[1:]
+        window = np.zeros((h, w), dtype=bool)
+        for row in range(3):
+            for col in range(3):
+                window |= invalid[row:row+h, col:col+w]
+        result[0, invalid[1:-1, 1:-1]] = nodata
+        result[1:, window] = nodata
+    return result
+
+
+def terrain_raster(source, path, band=1, tilesize=1024, workers=1,
+        dtype='float32', cog=True):
+    """Write the terrain derivatives of a whole raster to a GeoTIFF.
+
+    Tiles are computed on a pool of processes and written by the calling
+    process. The output is tiled, compressed and has internal overviews,
+    and is converted with the GDAL COG driver when cog is set and the
+    driver is available. Overviews use nearest resampling as averaging
+    the aspect angles would be meaningless. Bands are elevation, slope,
+    aspect and plan, profile and mean curvature (see terrain_analysis).
+
+    Args:
+      source (str): raster file path or URL
+      path (str): output file path
+      band (int): elevation band
+      tilesize (int): size of the tiles computed at a time
+      workers (int): number of processes (default=1)
+      dtype (dtype): output type (default=float32)
+      cog (bool): write a Cloud Optimized GeoTIFF (default=True)
+
+    Returns:
+      (str): path
+    """
+
+    with rasterio.open(source) as src:
+        profile = dict(driver='GTiff', count=len(BANDS), dtype=dtype,
+                crs=src.crs, transform=src.transform, nodata=src.nodata,
+                width=src.width, height=src.height, tiled=True,
+                blockxsize=512, blockysize=512, compress='deflate',
+                BIGTIFF='IF_SAFER')
+
+    windows = tile_windows(profile['width'], profile['height'], tilesize)
+    _logger.info('computing derivatives of %s in %d tiles', source,
+            len(windows))
+
+    tmp = '{}.{}.tmp.tif'.format(path, os.getpid())
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        with rasterio.open(tmp, 'w', **profile) as dst:
+            for i, name in enumerate(BANDS, 1):
+                dst.set_band_description(i, name)
+
+            args = ([source] * len(windows), windows, [band] * len(windows),
+                    [dtype] * len(windows))
+            if executor:
+                tiles = executor.map(terrain_tile, *args,
+                        chunksize=max(1, len(windows) // (workers * 8)))
+            else:
+                tiles = map(terrain_tile, *args)
+            for window, tile in zip(windows, tiles):
+                dst.write(tile, window=window)
+
+            factors = []
+            while min(dst.width, dst.height) // 2**(len(factors)+1) >= 256:
+                factors.append(2**(len(factors)+1))
+            if factors:
+                dst.build_overviews(factors, Resampling.nearest)
+
+        with rasterio.Env() as env:
+            cog = cog and 'COG' in env.drivers()
+        if cog:
+            rasterio.shutil.copy(tmp, path, driver='COG', compress='deflate',
+                    blocksize=512, resampling='NEAREST', BIGTIFF='IF_SAFER')
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+    finally:
+        if executor:
+            executor.shutdown()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return path
+
+
+def get_parser():
+    """Configure command line arguments
+
+    Returns:
+      :obj:`argparse.ArgumentParser`:
+    """
+    parser = argparse.ArgumentParser(
+        description="Precompute terrain derivatives of an elevation raster")
+    parser.add_argument(
+        'raster',
+        metavar='RASTER',
+        help='elevation raster file or URL')
+    parser.add_argument(
+        'output',
+        metavar='FILE',
+        help='output GeoTIFF')
+    parser.add_argument(
+        '-b', '--band',
+        metavar='INDEX',
+        type=int,
+        default=1,
+        help='elevation band (default=1)')
+    parser.add_argument(
+        '--tilesize',
+        metavar='PIXELS',
+        type=int,
+        default=1024,
+        help='size of tiles computed at a time (default=1024)')
+    parser.add_argument(
+        '-w', '--workers',
+        metavar='COUNT',
+        type=int,
+        default=1,
+        help='number of processes (default=1)')
+    parser.add_argument(
+        '--no-cog',
+        dest='cog',
+        action='store_false',
+        default=True,
+        help='write a tiled GeoTIFF instead of a COG')
+    parser.add_argument(
+        '-V', '--version',
+        action='version',
+        version='keras-spatial {ver}'.format(ver=__version__))
+    parser.add_argument(
+        '-v', '--verbose',
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action='store_const',
+        const=logging.INFO)
+    parser.add_argument(
+        '-vv', '--very-verbose',
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action='store_const',
+        const=logging.DEBUG)
+    return parser
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+
+def main(args):
+    """Main entry point allowing external calls
+
+    Args:
+      args ([str]): command line parameter list
+    """
+    parser = get_parser()
+    args = parser.parse_args(args)
+    setup_logging(args.loglevel)
+
+    terrain_raster(args.raster, args.output, band=args.band,
+            tilesize=args.tilesize, workers=args.workers, cog=args.cog)
+    _logger.info('wrote %s', args.output)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
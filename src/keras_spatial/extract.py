@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline extraction of samples to a single .npy file shared by worker
+processes and, through shard and shards, by several cluster nodes.
+"""
+
+import os
+import sys
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import geopandas as gpd
+
+from keras_spatial import __version__
+from keras_spatial.datagen import SpatialDataGenerator
+from keras_spatial.samples import spatial_order
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+def spatial_shards(dataframe, count):
+    """Split samples into spatially compact shards.
+
+    Args:
+      dataframe (GeoDataFrame): dataframe containing samples
+      count (int): number of shards
+
+    Returns:
+      list(ndarray): positional indexes into dataframe for each shard
+    """
+
+    if count < 1:
+        raise ValueError('shard count must be positive')
+
+    return np.array_split(spatial_order(dataframe), count)
+
+
+def open_output(path, shape, dtype):
+    """Open the shared output array, creating it if necessary.
+
+    Creation is atomic so concurrent nodes agree on a single file.
+
+    Args:
+      path (str): .npy file path
+      shape (tuple): array shape
+      dtype (dtype): array type
+
+    Returns:
+      (memmap)
+    """
+
+    if not os.path.exists(path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype,
+                shape=shape).flush()
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+
+    out = np.lib.format.open_memmap(path, mode='r+')
+    if out.shape != tuple(shape) or out.dtype != np.dtype(dtype):
+        raise ValueError('existing output {} has shape {} {}'.format(
+                path, out.shape, out.dtype))
+    return out
+
+
+def _extract_shard(sdg, df, positions, path, width, height, batch_size):
+    """Extract one shard into rows positions of the shared output"""
+
+    out = np.lib.format.open_memmap(path, mode='r+')
+    i = 0
+    for batch in sdg.flow_from_dataframe(df, width, height, batch_size):
+        out[positions[i:i+len(batch)]] = batch
+        i += len(batch)
+    out.flush()
+    return i
+
+
+def extract(sdg, dataframe, path, width=0, height=0, batch_size=0,
+        shard=0, shards=1, workers=1):
+    """Extract samples to a .npy file using a pool of processes.
+
+    The output holds one sample per dataframe row, in dataframe order.
+    The samples are split spatially into shards equal parts and only
+    part shard is extracted, so the same job can be run on several
+    nodes sharing the output path. Each part is further split into
+    spatially compact tasks run on a ProcessPoolExecutor, each process
+    with its own copy of sdg. The patch cache is only used when a single
+    process extracts the whole job (workers=1 and shards=1), as patch
+    stores are not safe for concurrent writers.
+
+    Args:
+      sdg (SpatialDataGenerator): generator defining source and profile
+      dataframe (GeoDataFrame): dataframe with spatial extents
+      path (str): output .npy file path
+      width (int): sample width in pixels (default=sdg.width)
+      height (int): sample height in pixels (default=sdg.height)
+      batch_size (int): batch size read by each process
+      shard (int): index of the part extracted by this call
+      shards (int): number of parts the job is split into
+      workers (int): number of processes
+
+    Returns:
+      (int): number of samples written
+    """
+
+    if shard < 0 or shard >= shards:
+        raise ValueError('shard must be between 0 and shards-1')
+    width = width if width else sdg.width
+    height = height if height else sdg.height
+    batch_size = batch_size if batch_size else sdg.batch_size
+
+    # sample shape and type after any preprocess callbacks
+    first = next(sdg.flow_from_dataframe(dataframe.iloc[:1], width, height,
+            batch_size=1))
+    open_output(path, (len(dataframe),) + first.shape[1:], first.dtype)
+
+    positions = spatial_shards(dataframe, shards)[shard]
+    if workers > 1 or shards > 1:
+        sdg = sdg.worker_copy()
+    tasks = [p for p in np.array_split(positions, workers * 4) if len(p)]
+    args = [(sdg, dataframe.iloc[p], p, path, width, height, batch_size)
+            for p in tasks]
+    _logger.info('extracting %d samples in %d tasks', len(positions),
+            len(tasks))
+
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_extract_shard, *a) for a in args]
+            return sum(f.result() for f in futures)
+    else:
+        return sum(_extract_shard(*a) for a in args)
+
+
+def get_parser():
+    """Configure command line arguments
+
+    Returns:
+      :obj:`argparse.ArgumentParser`:
+    """
+    parser = argparse.ArgumentParser(
+        description="Extract samples from a raster to a .npy file")
+    parser.add_argument(
+        'raster',
+        metavar='RASTER',
+        help='raster file or URL')
+    parser.add_argument(
+        'samples',
+        metavar='SAMPLES',
+        help='vector file defining samples')
+    parser.add_argument(
+        'output',
+        metavar='FILE',
+        help='output .npy file')
+    parser.add_argument(
+        'size',
+        metavar='SIZE',
+        type=int,
+        nargs=2,
+        help='sample width and height in pixels')
+    parser.add_argument(
+        '-b', '--batch-size',
+        metavar='COUNT',
+        type=int,
+        default=32,
+        help='samples read per batch (default=32)')
+    parser.add_argument(
+        '-w', '--workers',
+        metavar='COUNT',
+        type=int,
+        default=1,
+        help='number of processes (default=1)')
+    parser.add_argument(
+        '--shard',
+        metavar='INDEX',
+        type=int,
+        default=0,
+        help='index of the shard extracted by this node (default=0)')
+    parser.add_argument(
+        '--shards',
+        metavar='COUNT',
+        type=int,
+        default=1,
+        help='number of shards the job is split into (default=1)')
+    parser.add_argument(
+        '-V', '--version',
+        action='version',
+        version='keras-spatial {ver}'.format(ver=__version__))
+    parser.add_argument(
+        '-v', '--verbose',
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action='store_const',
+        const=logging.INFO)
+    parser.add_argument(
+        '-vv', '--very-verbose',
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action='store_const',
+        const=logging.DEBUG)
+    return parser
+
+
+def setup_logging(loglevel):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+
+def main(args):
+    """Main entry point allowing external calls
+
+    Args:
+      args ([str]): command line parameter list
+    """
+    parser = get_parser()
+    args = parser.parse_args(args)
+    setup_logging(args.loglevel)
+
+    sdg = SpatialDataGenerator(source=args.raster)
+    df = gpd.read_file(args.samples)
+
+    count = extract(sdg, df, args.output, *args.size,
+            batch_size=args.batch_size, shard=args.shard,
+            shards=args.shards, workers=args.workers)
+    _logger.info('wrote %d samples to %s', count, args.output)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -20,11 +20,11 @@ import argparse
 import sys
 import logging
 import numpy as np
-from shapely.geometry import box
 import rasterio as rio
 import geopandas as gpd
 
 from keras_spatial import __version__
+from keras_spatial.samples import boxes, mask_grid
 
 __author__ = "Jeff Terstriep"
 __copyright__ = "Jeff Terstriep"
@@ -47,24 +47,6 @@ def raster_meta(fname):
         return (src.bounds, (src.width, src.height), src.crs)
 
 
-## TODO complete
-def mask_grid(dataframe, fname, hard=False):
-    """Filter dataframe removing patches outside an area.
-
-    Args:
-      dataframe (GeoDataFrame): dataframe contain grid
-      fname (str): file path to vector boundary
-      hard (bool): if true, patches must be fully within boundary
-
-    Returns:
-      geopandas.GeoDataFrame:
-    """  
-
-    if isinstance(fname, str):
-        with fiona.open(fname) as mask:
-            pass
-
-
 def sample_size(dataframe):
     """Return the sample size in coordinate space.
 
@@ -96,12 +78,13 @@ def regular_grid(xmin, ymin, xmax, ymax, xsize, ysize, overlap=0, crs=None):
       geopandas.GeoDataFrame:
     """
 
-    x = np.linspace(xmin, xmax-xsize, num=(xmax-xmin)//(xsize-xsize*overlap))
-    y = np.linspace(ymin, ymax-ysize, num=(ymax-ymin)//(ysize-ysize*overlap))
+    x = np.linspace(xmin, xmax-xsize,
+            num=int((xmax-xmin)//(xsize-xsize*overlap)))
+    y = np.linspace(ymin, ymax-ysize,
+            num=int((ymax-ymin)//(ysize-ysize*overlap)))
     X,Y = np.meshgrid(x, y)
-    polys = [box(x, y, x+xsize, y+ysize) for x,y in np.nditer([X,Y])]
 
-    gdf = gpd.GeoDataFrame({'geometry':polys})
+    gdf = gpd.GeoDataFrame(geometry=boxes(X.ravel(), Y.ravel(), xsize, ysize))
     gdf.crs = crs
     return gdf
 
@@ -125,9 +108,8 @@ def random_grid(xmin, ymin, xmax, ymax, xsize, ysize, count, crs=None):
 
     x = np.random.rand(count) * (xmax-xmin-xsize) + xmin
     y = np.random.rand(count) * (ymax-ymin-ysize) + ymin
-    polys = [box(x, y, x+xsize, y+ysize) for x,y in np.nditer([x,y])]
 
-    gdf = gpd.GeoDataFrame({'geometry':polys})
+    gdf = gpd.GeoDataFrame(geometry=boxes(x, y, xsize, ysize))
     gdf.crs = crs
     return gdf
 
@@ -191,6 +173,11 @@ def get_parser():
         '-m', '--mask',
         metavar='FILE',
         help='vector file used to define irregular study area')
+    parser.add_argument(
+        '--hard',
+        action='store_true',
+        default=False,
+        help='keep only patches fully within the mask')
     parser.add_argument(
         '-t', '--target-crs',
         metavar='PROJ',
@@ -259,7 +246,10 @@ def main(args):
         df = regular_grid(*args.extent, *args.size, args.overlap)
 
     df.crs = args.extent_crs
-    
+
+    if args.mask:
+        df = mask_grid(df, args.mask, hard=args.hard)
+
     if args.target_crs:
         df.to_crs(args.target_crs)
 
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fused reading of several rasters, e.g. DEM, imagery and labels, into a
+single aligned (x, y) batch.
+"""
+
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from keras_spatial.datagen import bounds_to_windows
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+class MultiSourceGenerator(object):
+
+    def __init__(self, x, y=None, interleave='pixel', workers=1):
+        """Read several sources into one preallocated batch per sample set
+
+        Each source is described by a SpatialDataGenerator, which sets its
+        path, bands and resampling. Sample windows are computed once for
+        all sources sharing a grid and every source is read straight into
+        its band slot of the x or y batch, so no per-source arrays are
+        stacked or concatenated.
+
+        Args:
+          x (SpatialDataGenerator|[SpatialDataGenerator]): input sources,
+                  bands are ordered by source then by band
+          y (SpatialDataGenerator|[SpatialDataGenerator]): optional target
+                  sources
+          interleave (str): type of interleave, 'pixel' or 'band'
+          workers (int): number of threads reading sources in parallel
+                  (default=1)
+        """
+
+        self.x = list(x) if isinstance(x, (list, tuple)) else [x]
+        if y is None:
+            self.y = []
+        else:
+            self.y = list(y) if isinstance(y, (list, tuple)) else [y]
+        self.interleave = interleave
+        self.workers = workers
+
+        for sdg in self.x + self.y:
+            if not sdg.src:
+                raise RuntimeError('source not set or failed to open')
+            if sdg.preprocess or sdg.batch_preprocess:
+                raise ValueError('preprocess callbacks are not supported '
+                        'on fused sources')
+            if sdg.halo:
+                raise ValueError('halo is not supported on fused sources')
+
+    def _slots(self, sources):
+        """return the (source, first band, band count) of each source"""
+
+        slots, start = [], 0
+        for sdg in sources:
+            count = 1 if isinstance(sdg.indexes, int) else len(sdg.indexes)
+            slots.append((sdg, start, count))
+            start += count
+        return slots, start
+
+    def _allocate(self, sources, count, width, height):
+        if not sources:
+            return None
+        _, bands = self._slots(sources)
+        dtype = np.result_type(*[sdg.src.dtypes[0] for sdg in sources])
+        if self.interleave == 'pixel':
+            return np.empty((count, height, width, bands), dtype=dtype)
+        return np.empty((count, bands, height, width), dtype=dtype)
+
+    def allocate_batch(self, count, width, height):
+        """Allocate empty x and y batch arrays
+
+        Each array holds the bands of all its sources, typed to fit the
+        bands of every source.
+
+        Args:
+          count (int): number of samples
+          width (int): sample width in pixels
+          height (int): sample height in pixels
+
+        Returns:
+          (tuple(ndarray, ndarray)): x and y, y is None without targets
+        """
+
+        return (self._allocate(self.x, count, width, height),
+                self._allocate(self.y, count, width, height))
+
+    def _slot(self, out, start, count, single):
+        """return the view of out holding a source's bands"""
+
+        if self.interleave == 'pixel':
+            return out[..., start] if single else out[..., start:start+count]
+        return out[:, start] if single else out[:, start:start+count]
+
+    def flow_from_dataframe(self, dataframe, width=0, height=0, batch_size=0,
+            buffers=0):
+        """extracts aligned batches from every source
+
+        Args:
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          width (int): sample width in pixels (default=first x width)
+          height (int): sample height in pixels (default=first x height)
+          batch_size (int): batch size (default=first x batch_size)
+          buffers (int): number of recycled batch tuples (default=0), see
+                  SpatialDataGenerator.flow_from_dataframe
+
+        Returns:
+          Iterator[ndarray | tuple(ndarray, ndarray)]: x, or x and y
+        """
+
+        first = self.x[0]
+        width = width if width else first.width
+        height = height if height else first.height
+        if width < 1 or height < 1:
+            raise ValueError('desired sample size must be set')
+        batch_size = batch_size if batch_size else first.batch_size
+        if batch_size < 1:
+            raise ValueError('batch size must be specified')
+
+        if buffers > 0:
+            ring = itertools.cycle([self.allocate_batch(batch_size, width,
+                    height) for _ in range(buffers)])
+        else:
+            ring = None
+
+        options = first.vrt_options(dataframe, width, height)
+        bounds = dataframe.geometry.values.bounds
+
+        # open each source on the shared grid, windows are computed once
+        # per distinct source grid, i.e. once when all are warped
+        readers, windows, keys = [], {}, []
+        xslots, _ = self._slots(self.x)
+        yslots, _ = self._slots(self.y)
+        try:
+            for target, slots in ((0, xslots), (1, yslots)):
+                for sdg, start, count in slots:
+                    opts = dict(options, resampling=sdg.resampling)
+                    level = sdg._level(opts)
+                    src = sdg._open_level(level)
+                    if sdg._read_mode(opts, src) == 'warp':
+                        transform = opts['transform']
+                    else:
+                        transform = src.transform
+                        opts = None
+                    key, src = sdg._acquire_vrt(opts, level)
+                    keys.append((sdg, key))
+                    grid = tuple(transform)[:6]
+                    if grid not in windows:
+                        windows[grid] = bounds_to_windows(transform, bounds)
+                    readers.append((sdg, src, windows[grid], target, start,
+                            count))
+
+            executor = ThreadPoolExecutor(self.workers) \
+                    if self.workers > 1 else None
+            try:
+                for i in range(0, len(dataframe), batch_size):
+                    count = min(batch_size, len(dataframe) - i)
+                    if ring:
+                        x, y = next(ring)
+                        batch = (x[:count], None if y is None else y[:count])
+                    else:
+                        batch = self.allocate_batch(count, width, height)
+
+                    def read(reader):
+                        sdg, src, win, target, start, n = reader
+                        view = self._slot(batch[target], start, n,
+                                isinstance(sdg.indexes, int))
+                        sdg._read_into(src, win[i:i+count], view,
+                                interleave=self.interleave)
+
+                    if executor:
+                        list(executor.map(read, readers))
+                    else:
+                        for reader in readers:
+                            read(reader)
+
+                    yield batch[0] if batch[1] is None else batch
+            finally:
+                if executor:
+                    executor.shutdown()
+        finally:
+            for sdg, key in keys:
+                sdg._release_vrt(key)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Selection of raster overview levels so coarse samples are resampled from
+the smallest sufficient level rather than from full resolution data.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+import rasterio
+from rasterio.windows import Window
+from rasterio.transform import Affine
+from rasterio.warp import transform_bounds
+
+from keras_spatial.cache import source_identity
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+def open_level(path, level=None):
+    """Open a raster at an overview level.
+
+    Args:
+      path (str): raster file path or URL
+      level (int): overview index (default=None for full resolution)
+
+    Returns:
+      (rasterio dataset)
+    """
+
+    if level is None:
+        return rasterio.open(path)
+    return rasterio.open(path, overview_level=level)
+
+
+def best_level(factors, factor):
+    """Return the index of the coarsest overview not coarser than factor.
+
+    Args:
+      factors ([int]): overview decimation factors in increasing order
+      factor (float): decimation required by the samples
+
+    Returns:
+      (int): overview index or None if no overview is usable
+    """
+
+    usable = [i for i, f in enumerate(factors) if f <= factor + 1e-6]
+    return usable[-1] if usable else None
+
+
+def decimation(src, options):
+    """Return the ratio of the VRT resolution to the source resolution.
+
+    Args:
+      src (rasterio dataset): the source raster
+      options (dict): WarpedVRT options (see vrt_options)
+
+    Returns:
+      (float): source pixels per output pixel along the finer axis
+    """
+
+    t = options['transform']
+    width, height = options['width'], options['height']
+    bounds = (t.c, t.f + t.e * height, t.c + t.a * width, t.f)
+    if options['crs'] != src.crs:
+        bounds = transform_bounds(options['crs'], src.crs, *bounds)
+
+    xres = (bounds[2] - bounds[0]) / width
+    yres = (bounds[3] - bounds[1]) / height
+    return min(xres / src.res[0], yres / src.res[1])
+
+
+def overview_cache(src, directory, resampling, tilesize=1024):
+    """Build, if necessary, a local half resolution copy of src.
+
+    The copy is a tiled GeoTIFF with internal overviews, so together
+    they serve every power of two decimation for sources without their
+    own overviews. The file name includes the source identity so a
+    changed source results in a new copy.
+
+    Args:
+      src (rasterio dataset): the source raster
+      directory (str): cache directory
+      resampling (Resampling): resampling used to build levels
+      tilesize (int): size of the windows copied at a time
+
+    Returns:
+      (str): path to the cached raster
+    """
+
+    key = json.dumps(dict(source_identity(src.name),
+            resampling=str(resampling)), sort_keys=True)
+    path = os.path.join(directory,
+            hashlib.sha1(key.encode()).hexdigest() + '.tif')
+    if os.path.exists(path):
+        return path
+
+    _logger.info('building overview cache %s for %s', path, src.name)
+    os.makedirs(directory, exist_ok=True)
+    profile = dict(driver='GTiff', count=src.count, dtype=src.dtypes[0],
+            crs=src.crs, nodata=src.nodata,
+            width=src.width // 2, height=src.height // 2,
+            transform=src.transform * Affine.scale(2),
+            tiled=True, blockxsize=256, blockysize=256, compress='deflate',
+            BIGTIFF='IF_SAFER')
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with rasterio.open(tmp, 'w', **profile) as dst:
+        for row in range(0, dst.height, tilesize):
+            for col in range(0, dst.width, tilesize):
+                window = Window(col, row, min(tilesize, dst.width - col),
+                        min(tilesize, dst.height - row))
+                arr = src.read(window=Window(col*2, row*2, window.width*2,
+                        window.height*2), resampling=resampling,
+                        out_shape=(src.count, window.height, window.width))
+                dst.write(arr, window=window)
+
+        factors = []
+        while min(dst.width, dst.height) // 2**(len(factors)+1) >= 256:
+            factors.append(2**(len(factors)+1))
+        if factors:
+            dst.build_overviews(factors, resampling)
+
+    os.replace(tmp, path)
+    return path
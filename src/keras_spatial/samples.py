@@ -5,11 +5,12 @@
 """
 
 import logging
+import itertools
 import collections
 
 import numpy as np
 import geopandas as gpd
-from shapely.geometry import box
+import shapely
 
 from keras_spatial import __version__
 
@@ -20,22 +21,49 @@ __license__ = "ncsa"
 _logger = logging.getLogger(__name__)
 
 
-## TODO complete
-def mask_grid(dataframe, fname, hard=False):
+def mask_grid(dataframe, fname, hard=False, chunksize=1000000):
     """Filter dataframe removing patches outside an area.
 
+    The boundary is dissolved into disjoint polygons which are used to
+    bulk query an STRtree of the patches, so each boundary polygon is
+    prepared once and only patches whose bounding boxes overlap it are
+    tested. Patches are indexed chunksize at a time to bound memory.
+
     Args:
       dataframe (GeoDataFrame): dataframe contain grid
-      fname (str): file path to vector boundary
+      fname (str|GeoDataFrame|GeoSeries|Geometry): file path to vector
+              boundary or the boundary itself, reprojected to the
+              dataframe crs when both are known
       hard (bool): if true, patches must be fully within boundary
+      chunksize (int): maximum number of patches indexed at a time
 
     Returns:
       geopandas.GeoDataFrame:
-    """  
+    """
 
     if isinstance(fname, str):
-        with fiona.open(fname) as mask:
-            pass
+        mask = gpd.read_file(fname).geometry
+    elif isinstance(fname, gpd.GeoDataFrame):
+        mask = fname.geometry
+    elif isinstance(fname, gpd.GeoSeries):
+        mask = fname
+    else:
+        mask = gpd.GeoSeries([fname])
+    if mask.crs and dataframe.crs and mask.crs != dataframe.crs:
+        mask = mask.to_crs(dataframe.crs)
+
+    parts = shapely.get_parts(shapely.union_all(mask.values))
+    predicate = 'covers' if hard else 'intersects'
+
+    geoms = dataframe.geometry.values
+    keep = np.zeros(len(dataframe), dtype=bool)
+    for i in range(0, len(dataframe), chunksize):
+        tree = shapely.STRtree(geoms[i:i+chunksize])
+        _, idx = tree.query(parts, predicate=predicate)
+        keep[idx + i] = True
+
+    _logger.info('mask kept %d of %d patches', keep.sum(), len(keep))
+    return dataframe[keep]
 
 
 def sample_size(dataframe):
@@ -52,6 +80,27 @@ def sample_size(dataframe):
     return (abs(left - right), abs(top - bottom))
 
 
+def boxes(x, y, xsize, ysize):
+    """Create sample polygons from arrays of lower-left coordinates.
+
+    All polygons are built in a single vectorized call rather than one
+    shapely.geometry.box per sample.
+
+    Args:
+      x (ndarray): left boundaries
+      y (ndarray): bottom boundaries
+      xsize (float): patch width
+      ysize (float): patch height
+
+    Returns:
+      (GeoSeries)
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return gpd.GeoSeries(shapely.box(x, y, x+xsize, y+ysize))
+
+
 def regular_grid(xmin, ymin, xmax, ymax, xsize, ysize, overlap=0, crs=None):
     """Generate regular grid over extent.
 
@@ -69,16 +118,55 @@ def regular_grid(xmin, ymin, xmax, ymax, xsize, ysize, overlap=0, crs=None):
       geopandas.GeoDataFrame:
     """
 
-    x = np.linspace(xmin, xmax-xsize, num=(xmax-xmin)//(xsize-xsize*overlap))
-    y = np.linspace(ymin, ymax-ysize, num=(ymax-ymin)//(ysize-ysize*overlap))
+    x = np.linspace(xmin, xmax-xsize,
+            num=int((xmax-xmin)//(xsize-xsize*overlap)))
+    y = np.linspace(ymin, ymax-ysize,
+            num=int((ymax-ymin)//(ysize-ysize*overlap)))
     X,Y = np.meshgrid(x, y)
-    polys = [box(x, y, x+xsize, y+ysize) for x,y in np.nditer([X,Y])]
 
-    gdf = gpd.GeoDataFrame({'geometry':polys})
+    gdf = gpd.GeoDataFrame(geometry=boxes(X.ravel(), Y.ravel(), xsize, ysize))
     gdf.crs = crs
     return gdf
 
 
+def regular_grid_chunks(xmin, ymin, xmax, ymax, xsize, ysize, overlap=0,
+        crs=None, chunksize=100000):
+    """Generate regular grid over extent in row-major chunks.
+
+    Produces the same samples (and index) as regular_grid without
+    materializing the whole grid, so memory is bounded by chunksize.
+
+    Args:
+      xmin (float): extent left boundary
+      ymin (float): extent bottom boundary
+      xmax (float): extent right boundary
+      ymax (float): extent top boundary
+      xsize (float): patch width
+      ysize (float): patch height
+      overlap (float): percentage of patch overlap (optional)
+      crs (CRS): crs to assign geodataframe 
+      chunksize (int): maximum number of samples per chunk
+
+    Returns:
+      Iterator[GeoDataFrame]
+    """
+
+    if chunksize < 1:
+        raise ValueError('chunksize must be positive')
+
+    x = np.linspace(xmin, xmax-xsize,
+            num=int((xmax-xmin)//(xsize-xsize*overlap)))
+    y = np.linspace(ymin, ymax-ysize,
+            num=int((ymax-ymin)//(ysize-ysize*overlap)))
+
+    for start in range(0, len(x) * len(y), chunksize):
+        idx = np.arange(start, min(start + chunksize, len(x) * len(y)))
+        gdf = gpd.GeoDataFrame(geometry=boxes(x[idx % len(x)],
+                y[idx // len(x)], xsize, ysize).set_axis(idx))
+        gdf.crs = crs
+        yield gdf
+
+
 def random_grid(xmin, ymin, xmax, ymax, xsize, ysize, count, crs=None):
     """Generate random grid over extent.
 
@@ -98,9 +186,8 @@ def random_grid(xmin, ymin, xmax, ymax, xsize, ysize, count, crs=None):
 
     x = np.random.rand(count) * (xmax-xmin-xsize) + xmin
     y = np.random.rand(count) * (ymax-ymin-ysize) + ymin
-    polys = [box(x, y, x+xsize, y+ysize) for x,y in np.nditer([x,y])]
 
-    gdf = gpd.GeoDataFrame({'geometry':polys})
+    gdf = gpd.GeoDataFrame(geometry=boxes(x, y, xsize, ysize))
     gdf.crs = crs
     return gdf
 
@@ -119,8 +206,7 @@ def point_grid(df, xsize, ysize, inplace=True):
     """
 
     halfx, halfy = xsize / 2.0, ysize / 2.0
-    polys = gpd.GeoSeries([box(pt.x - halfx, pt.y - halfy, 
-            pt.x + halfx, pt.y + halfy) for pt in df.geometry])
+    polys = boxes(df.geometry.x - halfx, df.geometry.y - halfy, xsize, ysize)
 
     if inplace:
         df['geometry'] = polys
@@ -129,6 +215,113 @@ def point_grid(df, xsize, ysize, inplace=True):
         return gpd.GeoDataFrame(geometry=polys)
 
 
+def _spread_bits(v):
+    """insert a zero bit between each of the low 32 bits of v"""
+
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+            (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333),
+            (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def _hilbert(x, y, bits):
+    """return the distance along a Hilbert curve of integer coordinates"""
+
+    x, y = x.astype(np.int64), y.astype(np.int64)
+    n = 1 << bits
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s //= 2
+    return d
+
+
+def curve_keys(x, y, curve='zorder', bits=16):
+    """Return the position of coordinates along a space-filling curve.
+
+    Args:
+      x (ndarray): x coordinates
+      y (ndarray): y coordinates
+      curve (str): 'zorder' or 'hilbert'
+      bits (int): bits per axis used to quantize coordinates
+
+    Returns:
+      (ndarray): integer keys, nearby keys are nearby in space
+    """
+
+    scale = (1 << bits) - 1
+    q = []
+    for v in (np.asarray(x, dtype=np.float64),
+            np.asarray(y, dtype=np.float64)):
+        span = v.max() - v.min() if len(v) else 0
+        q.append((v - v.min()) / span * scale if span > 0
+                else np.zeros_like(v))
+
+    if curve == 'hilbert':
+        return _hilbert(q[0], q[1], bits)
+    elif curve == 'zorder':
+        return _spread_bits(q[0].astype(np.uint64)) | \
+                (_spread_bits(q[1].astype(np.uint64)) << np.uint64(1))
+    else:
+        raise ValueError('curve must be "zorder" or "hilbert"')
+
+
+def window_order(keys, window=0):
+    """Return positions sorting keys within consecutive windows.
+
+    Args:
+      keys (ndarray): sort keys
+      window (int): number of positions per window (default=0 for all)
+
+    Returns:
+      (ndarray): positional indexes
+    """
+
+    if window < 1 or window >= len(keys):
+        return np.argsort(keys, kind='stable')
+
+    pad = -len(keys) % window
+    order = np.argsort(np.concatenate((keys, np.full(pad, keys.max()))
+            ).reshape(-1, window), axis=1, kind='stable')
+    order += np.arange(0, len(order) * window, window)[:, None]
+    order = order.ravel()
+    return order[order < len(keys)]
+
+
+def spatial_order(dataframe, bits=16, curve='zorder', window=0):
+    """Return sample positions sorted along a space-filling curve.
+
+    Samples close together in the returned order are close together
+    in space, so contiguous runs touch compact regions of the raster.
+    With window set, samples are only reordered within consecutive runs
+    of that many samples so the existing (e.g. shuffled) order is kept
+    at a coarser scale.
+
+    Args:
+      dataframe (GeoDataFrame): dataframe containing samples
+      bits (int): bits per axis used to quantize sample centroids
+      curve (str): 'zorder' or 'hilbert'
+      window (int): samples per reordering window (default=0 for all)
+
+    Returns:
+      (ndarray): positional indexes into dataframe
+    """
+
+    bounds = dataframe.geometry.values.bounds
+    keys = curve_keys((bounds[:,0] + bounds[:,2]) / 2.0,
+            (bounds[:,1] + bounds[:,3]) / 2.0, curve, bits)
+    return window_order(keys, window)
+
+
 class AttributeGenerator(object):
 
     def __init__(self):
@@ -138,6 +331,24 @@ class AttributeGenerator(object):
     def append(self, name, func, *args, **kwargs):
         """Append callback function to AttributeGenerator
 
+        The callback is called with each sample array and returns a
+        single value.
+
+        Args:
+          name (str): name of the callback
+          func (function): function to be called
+          args (list): arguments to be passed to the callback
+          kwargs (dict): keyword arguments to be passed to callback
+        """
+
+        self.callbacks[name] = (func, args, kwargs, False)
+
+    def append_batch(self, name, func, *args, **kwargs):
+        """Append a vectorized callback function to AttributeGenerator
+
+        The callback is called with a batch of samples and returns one
+        value per sample, e.g. by reducing every axis but the first.
+
         Args:
           name (str): name of the callback
           func (function): function to be called
@@ -145,51 +356,76 @@ class AttributeGenerator(object):
           kwargs (dict): keyword arguments to be passed to callback
         """
 
-        self.callbacks[name] = (func, args, kwargs)
+        self.callbacks[name] = (func, args, kwargs, True)
+
+    def fill(self, df, sdg, width=0, height=0, batch_size=256, workers=1):
+        """Fill dataframe with attributes computed from each sample
 
-    def fill(self, df, sdg, width=0, height=0):
-        """Fill dataframe with attributes by each sample individually
+        Samples are read batch_size at a time. With workers set, the
+        dataframe is split into contiguous parts read and reduced on
+        separate threads (see SpatialDataGenerator.map_parts).
 
         Args:
           df (dataframe): a geodataframe which defines sample boundaries
           sdg (SpatialDataGenerator): the SDG for the raster source
           width (int): sample width
           height (int): sample height
+          batch_size (int): samples read at a time (default=256)
+          workers (int): number of threads (default=1)
 
         Returns:
           (GeoDataFrame): original dataframe with new attributes
         """
 
-        attributes = collections.defaultdict(list)
-        for arr in sdg.flow_from_dataframe(df, width, height, batch_size=1):
-            for name,callback in self.callbacks.items():
-                func, args, kwargs = callback
-                attributes[name].append(func(arr, *args, **kwargs))
+        if not len(df):
+            return df
 
-        for name,values in attributes.items():
-            df[name] = values
+        results = sdg.map_parts(lambda part, gen: self._attributes(part,
+                gen, width, height, batch_size), df, workers)
+
+        for name,(_, _, _, batch) in self.callbacks.items():
+            chunks = itertools.chain.from_iterable(r[name] for r in results)
+            df[name] = np.concatenate(list(chunks)) if batch else list(chunks)
 
         return df
 
+    def _attributes(self, df, sdg, width, height, batch_size):
+        """return the callback results for each batch of df"""
+
+        attributes = collections.defaultdict(list)
+        for arr in sdg.flow_from_dataframe(df, width, height,
+                batch_size=batch_size):
+            for name,(func, args, kwargs, batch) in self.callbacks.items():
+                if batch:
+                    attributes[name].append(func(arr, *args, **kwargs))
+                else:
+                    attributes[name].extend(func(a, *args, **kwargs)
+                            for a in arr)
+        return attributes
+
     def nodata(self, value):
         """convenience method to add callback to count nodata cells"""
 
         def _nodata(arr, value):
-            return (arr == value).sum()
+            return (arr == value).reshape(len(arr), -1).sum(axis=1)
 
-        self.append('nodata', _nodata, value)
+        self.append_batch('nodata', _nodata, value)
 
     def minmax(self):
         """convenience method to add callbacks for min and max"""
 
-        self.append('min', np.amin)
-        self.append('max', np.amax)
+        self.append_batch('min', _reduce, np.amin)
+        self.append_batch('max', _reduce, np.amax)
 
     def stats(self):
         """convenience method to add basic stats"""
 
         self.minmax()
-        self.append('mean', np.mean)
-        self.append('std', np.std)
+        self.append_batch('mean', _reduce, np.mean)
+        self.append_batch('std', _reduce, np.std)
+
 
+def _reduce(arr, func):
+    """reduce each sample of a batch to a single value"""
 
+    return func(arr.reshape(len(arr), -1), axis=1)
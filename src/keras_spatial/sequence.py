@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import rasterio
+from rasterio.vrt import WarpedVRT
+import numpy as np
+
+from keras_spatial.overview import open_level
+
+try:
+    from tensorflow.keras.utils import Sequence
+except ImportError:
+    try:
+        from keras.utils import Sequence
+    except ImportError:
+        Sequence = object
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SpatialSequence(Sequence):
+
+    def __init__(self, sdg, dataframe, width=0, height=0, batch_size=0,
+            y_col=None, shuffle=False, seed=None, **kwargs):
+        """Indexable batches from a SpatialDataGenerator for Keras fit
+
+        Sample windows are computed once up front. Raster handles are
+        opened lazily per process and thread, so the sequence can be used
+        with workers > 1 and use_multiprocessing=True, and restarting an
+        epoch does not rebuild anything. Batch callbacks that set an
+        indexed attribute, such as GeometricAugmenter, receive the (epoch,
+        batch index) of every batch, the epoch advancing at on_epoch_end.
+
+        Args:
+          sdg (SpatialDataGenerator): generator defining source and profile
+          dataframe (GeoDataFrame): dataframe with spatial extents
+          width (int): sample width in pixels (default=sdg.width)
+          height (int): sample height in pixels (default=sdg.height)
+          batch_size (int): batch size (default=sdg.batch_size)
+          y_col (str|[str]): optional dataframe column(s) used as targets
+          shuffle (bool): shuffle samples at the end of every epoch
+          seed (int): random seed used when shuffling
+          kwargs (dict): passed to keras.utils.Sequence
+        """
+
+        if Sequence is not object:
+            super().__init__(**kwargs)
+
+        self.sdg = sdg
+        self.width = width if width else sdg.width
+        self.height = height if height else sdg.height
+        if self.width < 1 or self.height < 1:
+            raise ValueError('desired sample size must be set')
+        self.batch_size = batch_size if batch_size else sdg.batch_size
+        if self.batch_size < 1:
+            raise ValueError('batch size must be specified')
+
+        sdg._check_halo()
+        self.options = sdg.vrt_options(dataframe, self.width, self.height)
+        self.level = sdg._level(self.options)
+        src = sdg._open_level(self.level)
+        self.mode = sdg._read_mode(self.options, src)
+        if self.mode == 'warp':
+            self.options = sdg._halo_options(self.options)
+        self.windows, self.pads = sdg._windows(
+                dataframe.geometry.values.bounds, self.options, self.mode, src)
+        self.dtype = sdg.allocate_batch(0, 1, 1).dtype
+        self.y = dataframe[y_col].to_numpy() if y_col else None
+
+        self.epoch = 0
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(dataframe))
+        if shuffle:
+            self.rng.shuffle(self.order)
+
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Drop open handles so the sequence can be pickled"""
+
+        state = self.__dict__.copy()
+        state['_handles'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Create a new handle lock after unpickling"""
+
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(np.ceil(len(self.order) / self.batch_size))
+
+    def __getitem__(self, index):
+        """Return batch number index
+
+        Returns:
+          (ndarray | tuple(ndarray, ndarray)): samples and optional targets
+        """
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('batch index out of range')
+
+        idx = self.order[index*self.batch_size:(index+1)*self.batch_size]
+        halo = self.sdg.halo
+        out = self.sdg.allocate_batch(len(idx), self.width + 2*halo,
+                self.height + 2*halo, dtype=self.dtype)
+        x = self.sdg.read_windows(self._dataset(), self.windows[idx], out=out,
+                pads=None if self.pads is None else self.pads[idx],
+                index=(self.epoch, index))
+        x = self.sdg._crop(x, self.width, self.height)
+
+        if self.y is None:
+            return x
+        return x, self.y[idx]
+
+    def on_epoch_end(self):
+        """Reshuffle samples and advance the epoch between epochs"""
+
+        self.epoch += 1
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+    def _dataset(self):
+        """Return the dataset owned by the calling process and thread"""
+
+        pid = os.getpid()
+        key = (pid, threading.get_ident())
+        with self._lock:
+            if key not in self._handles:
+                # handles inherited through fork are not safe to use
+                for stale in [k for k in self._handles if k[0] != pid]:
+                    del self._handles[stale]
+                if self.level:
+                    src = open_level(*self.level)
+                else:
+                    src = rasterio.open(self.sdg.source)
+                if self.mode == 'warp':
+                    self._handles[key] = (src, WarpedVRT(src,
+                            **self.options))
+                else:
+                    self._handles[key] = (src,)
+            return self._handles[key][-1]
+
+    def close(self):
+        """Close raster handles opened by this process"""
+
+        pid = os.getpid()
+        with self._lock:
+            for key in [k for k in self._handles if k[0] == pid]:
+                for handle in reversed(self._handles.pop(key)):
+                    handle.close()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Streaming per band statistics, computed in a single pass over the batches
+of a generator, used to derive normalization parameters.
+"""
+
+import logging
+
+import numpy as np
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+_logger = logging.getLogger(__name__)
+
+
+class BandStats(object):
+
+    def __init__(self, bands=1, axis=-1, nodata=None, bins=1024):
+        """Mergeable running statistics for each band of a sample set
+
+        Count, mean and variance use the parallel form of Welford's
+        algorithm so batches, and accumulators from separate workers,
+        are combined without loss of precision. Percentiles come from
+        a fixed number of histogram bins whose range grows as needed,
+        so they are approximate to within about one bin width.
+
+        An instance can be registered as a batch preprocess callback,
+        it updates itself and returns the batch unchanged.
+
+        Args:
+          bands (int): number of bands
+          axis (int): band axis of the batches, -1 for pixel and 1 for
+                  band interleave, None when batches have a single band
+          nodata (float): optional value excluded from the statistics
+          bins (int): histogram bins per band
+        """
+
+        self.bands = bands
+        self.axis = axis
+        self.nodata = nodata
+        self.bins = bins
+        self.count = np.zeros(bands, dtype=np.int64)
+        self.mean = np.zeros(bands)
+        self.m2 = np.zeros(bands)
+        self.min = np.full(bands, np.inf)
+        self.max = np.full(bands, -np.inf)
+        self.hist = np.zeros((bands, bins))
+        self.edges = None
+
+    def __call__(self, batch):
+        self.update(batch)
+        return batch
+
+    @property
+    def var(self):
+        return self.m2 / np.maximum(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def _values(self, batch):
+        """return batch as a (pixels, bands) array and valid mask"""
+
+        arr = np.asarray(batch)
+        if self.axis is None:
+            arr = arr.reshape(-1, 1)
+        else:
+            arr = np.moveaxis(arr, self.axis, -1).reshape(-1,
+                    arr.shape[self.axis])
+        if arr.shape[1] != self.bands:
+            raise ValueError('expected {} bands, got {}'.format(self.bands,
+                    arr.shape[1]))
+
+        arr = arr.astype(np.float64, copy=False)
+        valid = np.isfinite(arr)
+        if self.nodata is not None:
+            valid &= arr != self.nodata
+        return arr, valid
+
+    def update(self, batch):
+        """Add a batch of samples to the statistics
+
+        Args:
+          batch (ndarray): batch array with bands along axis
+        """
+
+        arr, valid = self._values(batch)
+        count = valid.sum(axis=0)
+        if not count.any():
+            return
+
+        zeroed = np.where(valid, arr, 0.0)
+        mean = zeroed.sum(axis=0) / np.maximum(count, 1)
+        m2 = (np.where(valid, arr - mean, 0.0) ** 2).sum(axis=0)
+        self._combine(count, mean, m2,
+                np.where(valid, arr, np.inf).min(axis=0),
+                np.where(valid, arr, -np.inf).max(axis=0))
+
+        self._grow(self.min, self.max)
+        for b in range(self.bands):
+            lo, hi = self.edges[b, 0], self.edges[b, -1]
+            idx = ((arr[valid[:, b], b] - lo) / (hi - lo) * self.bins)
+            idx = np.clip(idx.astype(np.int64), 0, self.bins - 1)
+            self.hist[b] += np.bincount(idx, minlength=self.bins)
+
+    def _combine(self, count, mean, m2, bmin, bmax):
+        """combine running moments with those of another set"""
+
+        total = self.count + count
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(total > 0,
+                    self.mean + delta * count / total, 0.0)
+            self.m2 = np.where(total > 0, self.m2 + m2 +
+                    delta ** 2 * self.count * count / total, 0.0)
+        self.count = total
+        self.min = np.minimum(self.min, bmin)
+        self.max = np.maximum(self.max, bmax)
+
+    def _grow(self, lo, hi):
+        """extend the histogram range to cover lo and hi"""
+
+        lo = np.where(np.isfinite(lo), lo, 0.0)
+        hi = np.where(np.isfinite(hi), hi, 0.0)
+        if self.edges is None:
+            hi = np.where(hi > lo, hi, lo + 1.0)
+            self.edges = np.linspace(lo, hi, self.bins + 1, axis=1)
+            return
+
+        for b in range(self.bands):
+            old = self.edges[b]
+            if lo[b] >= old[0] and hi[b] <= old[-1]:
+                continue
+            # double the range until it fits so repeated growth is rare
+            span = old[-1] - old[0]
+            start, stop = old[0], old[-1]
+            while lo[b] < start or hi[b] > stop:
+                span *= 2
+                if lo[b] < start:
+                    start = stop - span
+                else:
+                    stop = start + span
+            edges = np.linspace(start, stop, self.bins + 1)
+            self.hist[b] = _rebin(self.hist[b], old, edges)
+            self.edges[b] = edges
+
+    def merge(self, other):
+        """Add the statistics of another accumulator to this one
+
+        Args:
+          other (BandStats): accumulator with the same bands
+
+        Returns:
+          (BandStats): self
+        """
+
+        if other.bands != self.bands:
+            raise ValueError('band counts differ')
+        if other.edges is None:
+            return self
+
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        self._grow(other.edges[:, 0], other.edges[:, -1])
+        for b in range(self.bands):
+            self.hist[b] += _rebin(other.hist[b], other.edges[b],
+                    self.edges[b])
+        return self
+
+    def percentile(self, q):
+        """Return approximate percentiles of each band
+
+        Args:
+          q (float|[float]): percentiles between 0 and 100
+
+        Returns:
+          (ndarray): (bands,) or (len(q), bands) values
+        """
+
+        q = np.asarray(q, dtype=np.float64)
+        result = np.empty(q.shape + (self.bands,))
+        for b in range(self.bands):
+            cdf = np.concatenate(([0.0], np.cumsum(self.hist[b])))
+            if self.edges is None or cdf[-1] == 0:
+                result[..., b] = np.nan
+                continue
+            value = np.interp(q / 100.0 * cdf[-1], cdf, self.edges[b])
+            result[..., b] = np.clip(value, self.min[b], self.max[b])
+        return result
+
+    def save(self, path):
+        """Write the statistics to a .npz file
+
+        Args:
+          path (str): file path
+        """
+
+        np.savez(path, bands=self.bands,
+                axis=np.nan if self.axis is None else self.axis,
+                nodata=np.nan if self.nodata is None else self.nodata,
+                bins=self.bins, count=self.count, mean=self.mean, m2=self.m2,
+                min=self.min, max=self.max, hist=self.hist,
+                edges=np.empty(0) if self.edges is None else self.edges)
+
+    @classmethod
+    def load(cls, path):
+        """Read statistics written by save
+
+        Args:
+          path (str): file path
+
+        Returns:
+          (BandStats)
+        """
+
+        with np.load(path) as f:
+            axis, nodata = float(f['axis']), float(f['nodata'])
+            stats = cls(int(f['bands']), None if np.isnan(axis) else int(axis),
+                    None if np.isnan(nodata) else nodata, int(f['bins']))
+            for name in ('count', 'mean', 'm2', 'min', 'max', 'hist'):
+                setattr(stats, name, f[name])
+            stats.edges = f['edges'] if f['edges'].size else None
+        return stats
+
+
+def _rebin(counts, edges, new_edges):
+    """redistribute histogram counts onto new bin edges"""
+
+    cdf = np.concatenate(([0.0], np.cumsum(counts)))
+    return np.diff(np.interp(new_edges, edges, cdf))
+
+
+def band_stats(sdg, dataframe, width=0, height=0, batch_size=256, workers=1,
+        nodata=None, bins=1024):
+    """Compute BandStats for every band of a generator in one pass
+
+    With workers set, the dataframe is split into contiguous parts read on
+    separate threads (see SpatialDataGenerator.map_parts) and the results
+    are merged.
+
+    Args:
+      sdg (SpatialDataGenerator): generator defining source and profile
+      dataframe (GeoDataFrame): dataframe with spatial extents
+      width (int): sample width in pixels (default=sdg.width)
+      height (int): sample height in pixels (default=sdg.height)
+      batch_size (int): samples read at a time (default=256)
+      workers (int): number of threads (default=1)
+      nodata (float): optional value excluded from the statistics
+      bins (int): histogram bins per band
+
+    Returns:
+      (BandStats)
+    """
+
+    if isinstance(sdg.indexes, int):
+        bands, axis = 1, None
+    else:
+        bands = len(sdg.indexes)
+        axis = -1 if sdg.interleave == 'pixel' else 1
+
+    def accumulate(df, gen):
+        stats = BandStats(bands, axis, nodata, bins)
+        for batch in gen.flow_from_dataframe(df, width, height,
+                batch_size=batch_size):
+            stats.update(batch)
+        return stats
+
+    results = sdg.map_parts(accumulate, dataframe, workers)
+    for other in results[1:]:
+        results[0].merge(other)
+    return results[0]
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import fiona
+from keras_spatial.samples import mask_grid
 
 def mask(df, mask):
     """intersect the geodataframe with a polygon
@@ -15,6 +15,6 @@ def mask(df, mask):
               reside within the mask boundary
     """
 
-    pass
+    return mask_grid(df, mask, hard=True)
 
 
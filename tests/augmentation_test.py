@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+from scipy import signal
+
+from keras_spatial.augmentation import terrain_analysis, normalize_batch
+from keras_spatial.augmentation import GeometricAugmenter
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def _reference(array, size):
+    """per kernel convolution version of terrain_analysis"""
+
+    px, py = size[0]/array.shape[-1], size[1]/array.shape[-2]
+    kernels = [np.array([[-1, 0, 1]] * 3) / (6*px),
+               np.array([[1]*3, [0]*3, [-1]*3]) / (6*py),
+               np.array([[1, -2, 1]] * 3) / (3*px**2),
+               np.array([[1]*3, [-2]*3, [1]*3]) / (3*py**2),
+               np.array([[-1, 0, 1], [0, 0, 0], [1, 0, -1]]) / (4*px*py)]
+    g, h, d, e, f = [signal.convolve2d(array, k, boundary='symm',
+            mode='same') for k in kernels]
+
+    p, q = g**2 + h**2, 1 + g**2 + h**2
+    return np.stack([array, np.sqrt(p), np.arctan(h/g),
+            -((h**2*d) - (2*g*h*f) + (g**2*e) / p**1.5),
+            -((g**2*d) + (2*g*h*f) + (h**2*e)) / (p * q**1.5),
+            -(((1 + h**2)*d) - (2*g*h*f) + ((1 + g**2)*e) / (2 * q**1.5))])
+
+@pytest.fixture
+def dem():
+    rng = np.random.default_rng(0)
+    return rng.normal(0, 5, (4, 24, 32)).cumsum(axis=1) + 100
+
+def test_terrain_analysis(dem):
+    for arr in dem:
+        result = terrain_analysis(arr, (64, 48))
+        assert result.shape == (6, 24, 32)
+        assert np.allclose(result, _reference(arr, (64, 48)))
+
+def test_terrain_analysis_batch(dem):
+    out = np.empty((4, 6, 24, 32), dtype=np.float32)
+    result = terrain_analysis(dem, (64, 48), dtype=np.float32, out=out)
+    assert result is out
+
+    expected = np.stack([_reference(arr, (64, 48)) for arr in dem])
+    assert np.allclose(result[:, :3], expected[:, :3], rtol=1e-4, atol=1e-4)
+    assert np.allclose(terrain_analysis(dem, (64, 48)), expected)
+
+def test_normalize_batch():
+    rng = np.random.default_rng(0)
+    batch = rng.integers(0, 1000, (5, 8, 8, 3)).astype(np.int16)
+    gmin, gmax = np.array([0, 100, 5]), np.array([1000, 900, 5])
+
+    result = normalize_batch(batch, gmin, gmax)
+    assert result.dtype == np.float32 and batch.dtype == np.int16
+    assert np.allclose(result[..., :2], (batch[..., :2] - gmin[:2])
+            / (gmax[:2] - gmin[:2]))
+    assert not result[..., 2].any()
+
+    band = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+    out = np.empty(band.shape, dtype=np.float16)
+    assert normalize_batch(band, gmin, gmax, interleave='band',
+            out=out) is out
+    assert np.allclose(out, result.transpose(0, 3, 1, 2), atol=1e-3)
+
+    data = batch.astype(np.float32)
+    mean, std = data.mean(axis=(0, 1, 2)), data.std(axis=(0, 1, 2))
+    assert normalize_batch(data, mean=mean, std=std, out=data) is data
+    assert np.allclose(data.mean(axis=(0, 1, 2)), 0, atol=1e-4)
+    assert np.allclose(data.std(axis=(0, 1, 2)), 1, atol=1e-4)
+
+    with pytest.raises(ValueError):
+        normalize_batch(batch, gmin)
+
+    # integer batches would be truncated in place
+    pixels = batch.astype(np.uint16)
+    with pytest.raises(TypeError):
+        normalize_batch(pixels, gmin, gmax, out=pixels)
+    assert np.array_equal(pixels, batch)
+
+def test_geometric_augmenter():
+    batch = np.arange(6 * 8 * 8 * 2).reshape(6, 8, 8, 2)
+
+    aug = GeometricAugmenter(crop=(5, 4), seed=3)
+    result = aug(batch)
+    assert result.shape == (6, 4, 5, 2)
+
+    aug.set_epoch(0)
+    params = aug.params(6, 8, 8)
+    for sample, out, k, flip, row, col in zip(batch, result, params['k'],
+            params['flip'], params['row'], params['col']):
+        sample = np.rot90(sample[::-1] if flip else sample, k)
+        assert np.array_equal(out, sample[row:row+4, col:col+5])
+
+    # reproducible per epoch and consistent across paired sources
+    aug.set_epoch(0)
+    label = GeometricAugmenter(crop=(5, 4), seed=3, interleave='band')
+    image, labels = aug(batch, batch[..., 0])
+    assert np.array_equal(image, result)
+    assert np.array_equal(labels, result[..., 0])
+    assert np.array_equal(label(np.moveaxis(batch, -1, 1)),
+            np.moveaxis(result, -1, 1))
+    aug.set_epoch(1)
+    assert not np.array_equal(aug(batch), result)
+
+def test_geometric_augmenter_index():
+    from keras_spatial import SpatialDataGenerator, SpatialSequence
+
+    image = SpatialDataGenerator(source='data/small.tif',
+            batch_preprocess=('augment', GeometricAugmenter(seed=7)))
+    label = SpatialDataGenerator(source='data/small.tif', indexes=1,
+            batch_preprocess=('augment', GeometricAugmenter(seed=7)))
+    df = image.regular_grid(64, 64)
+
+    # extra calls on one generator do not desynchronize the pair
+    next(image.flow_from_dataframe(df, 64, 64))
+    for x, y in zip(image.flow_from_dataframe(df, 64, 64, epoch=1),
+            label.flow_from_dataframe(df, 64, 64, epoch=1)):
+        assert np.array_equal(x[..., 0], y)
+
+    # without an epoch argument the augmenter's own epoch is used
+    aug = image.batch_preprocess['augment'][0]
+    first = next(image.flow_from_dataframe(df, 64, 64))
+    assert np.array_equal(next(image.flow_from_dataframe(df, 64, 64)), first)
+    aug.set_epoch(1)
+    assert np.array_equal(next(image.flow_from_dataframe(df, 64, 64)),
+            next(image.flow_from_dataframe(df, 64, 64, epoch=1)))
+    assert not np.array_equal(next(image.flow_from_dataframe(df, 64, 64)),
+            first)
+    aug.set_epoch(0)
+
+    # unseeded augmenters draw new transforms every time
+    unseeded = GeometricAugmenter()
+    assert not np.array_equal(unseeded(first), unseeded(first))
+
+    # nor does out of order access of a sequence
+    images = SpatialSequence(image, df, 64, 64)
+    labels = SpatialSequence(label, df, 64, 64)
+    images.on_epoch_end()
+    labels.on_epoch_end()
+    x = [images[i] for i in (2, 0, 1)]
+    y = [labels[i] for i in (0, 1, 2)]
+    for xi, yi in zip(x, (y[2], y[0], y[1])):
+        assert np.array_equal(xi[..., 0], yi)
+
+    # random crops cannot be combined with a halo
+    image.halo = 2
+    image.batch_preprocess['augment'][0].crop = (32, 32)
+    with pytest.raises(ValueError):
+        next(image.flow_from_dataframe(df, 64, 64))
+    with pytest.raises(ValueError):
+        SpatialSequence(image, df, 64, 64)
+
+def test_geometric_augmenter_rectangular():
+    batch = np.arange(4 * 6 * 8).reshape(4, 6, 8)
+
+    aug = GeometricAugmenter(seed=0)
+    for _ in range(5):
+        params = aug.params(4, 6, 8)
+        assert set(params['k']) <= {0, 2}
+        result = aug.apply(batch, params)
+        for sample, out, k, flip in zip(batch, result, params['k'],
+                params['flip']):
+            assert np.array_equal(out, np.rot90(sample[::-1] if flip
+                    else sample, k))
+
+    with pytest.raises(ValueError):
+        GeometricAugmenter(crop=(10, 4)).params(4, 6, 8)
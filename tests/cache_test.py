@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import pickle
+import numpy as np
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.cache import BlockCache
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def test_cache_epochs(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif',
+            cache=str(tmp_path / 'cache'))
+    df = sdg.regular_grid(64, 64)
+
+    first = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    store, = sdg.cache.stores.values()
+    assert len(store) == len(df)
+
+    second = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    assert np.array_equal(first, second)
+    assert len(store) == len(df)
+
+def test_cache_persistent(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif',
+            cache=str(tmp_path / 'cache'))
+    df = sdg.regular_grid(64, 64)
+    first = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+
+    # a pickled cache reopens its stores from disk
+    cache = pickle.loads(pickle.dumps(sdg.cache))
+    assert not cache.stores
+    arr = sdg.allocate_batch(len(df), 64, 64)
+    store = cache.store(sdg.source, dict(sdg.profile, width=64, height=64,
+            crs=df.crs.to_wkt(), indexes=sdg.indexes, level=None),
+            arr.shape[1:], arr.dtype)
+    assert len(store.get(df.geometry.values.bounds, arr)) == 0
+    assert np.array_equal(arr, first)
+
+def test_cache_profile(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif',
+            cache=str(tmp_path / 'cache'))
+    df = sdg.regular_grid(64, 64)
+
+    list(sdg.flow_from_dataframe(df, 64, 64))
+    list(sdg.flow_from_dataframe(df, 32, 32))
+    assert len(sdg.cache.stores) == 2
+
+def test_cache_invalidate(tmp_path):
+    source = str(tmp_path / 'small.tif')
+    shutil.copy('data/small.tif', source)
+    sdg = SpatialDataGenerator(source=source, cache=str(tmp_path / 'cache'))
+    df = sdg.regular_grid(64, 64)
+
+    list(sdg.flow_from_dataframe(df.iloc[:10], 64, 64))
+    store, = sdg.cache.stores.values()
+    assert len(store) == 10
+
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    list(sdg.flow_from_dataframe(df.iloc[:5], 64, 64))
+    store, = sdg.cache.stores.values()
+    assert len(store) == 5
+
+def test_block_cache():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100, overlap=.5)
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100)))
+    sdg.block_cache = BlockCache()
+    arr = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100)))
+    assert np.array_equal(arr, expected)
+    assert sdg.block_cache.hits > sdg.block_cache.misses > 0
+
+def test_block_cache_evict():
+    sdg = SpatialDataGenerator(source='data/small.tif', block_cache=2**18)
+    df = sdg.regular_grid(100, 100)
+
+    list(sdg.flow_from_dataframe(df, 100, 100))
+    assert sdg.block_cache.evictions > 0
+    assert sdg.block_cache.nbytes <= 2**18
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.coverage import CoverageIndex
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+@pytest.fixture
+def sparse(tmp_path):
+    """512x512 raster, valid only in the left half"""
+
+    path = str(tmp_path / 'sparse.tif')
+    arr = np.full((1, 512, 512), -9999, dtype='float32')
+    arr[:, :, :256] = 1
+    with rasterio.open(path, 'w', driver='GTiff', count=1, dtype='float32',
+            width=512, height=512, crs='EPSG:26916', nodata=-9999,
+            transform=from_origin(0, 512, 1, 1)) as dst:
+        dst.write(arr)
+    return path
+
+def test_valid_fraction(sparse):
+    with rasterio.open(sparse) as src:
+        index = CoverageIndex.from_source(src, factor=8)
+    assert index.fraction.shape == (64, 64)
+
+    fraction = index.valid_fraction([[0, 0, 64, 64], [448, 0, 512, 64],
+            [224, 0, 288, 64], [-64, 0, 0, 64]])
+    assert np.allclose(fraction, [1, 0, 0.5, 0])
+
+def test_unaligned_edge(tmp_path):
+    path = str(tmp_path / 'edge.tif')
+    arr = np.full((1, 512, 500), -9999, dtype='float32')
+    arr[:, :, :260] = 1
+    with rasterio.open(path, 'w', driver='GTiff', count=1, dtype='float32',
+            width=500, height=512, crs='EPSG:26916', nodata=-9999,
+            transform=from_origin(0, 512, 1, 1)) as dst:
+        dst.write(arr)
+
+    with rasterio.open(path) as src:
+        index = CoverageIndex.from_source(src, factor=16, strip_pixels=5000)
+    assert index.fraction.shape == (32, 32)
+    assert np.allclose(index.fraction[:, 16], 0.25)
+    assert not index.fraction[:, 31].any()
+
+    sdg = SpatialDataGenerator(source=path)
+    df = sdg.regular_grid(16, 16)
+    kept = sdg.filter_nodata(df, 0, index=index)
+    assert (kept.geometry.bounds.maxx <= 256).all()
+    assert len(sdg.filter_nodata(df, 0.75, index=index)) == \
+            len(kept) + 32
+
+def test_filter_nodata(sparse):
+    sdg = SpatialDataGenerator(source=sparse)
+    df = sdg.regular_grid(64, 64)
+
+    kept = sdg.filter_nodata(df, threshold=0)
+    assert len(kept) == len(df) // 2
+    assert (kept.geometry.bounds.maxx <= 256).all()
+    for batch in sdg.flow_from_dataframe(kept, 64, 64):
+        assert (batch != -9999).all()
+
+    df = sdg.regular_grid(64, 64, overlap=0.5)
+    assert len(sdg.filter_nodata(df, threshold=0.5)) > \
+            len(sdg.filter_nodata(df, threshold=0))
+    assert len(sdg.filter_nodata(df, threshold=1)) == len(df)
+
+def test_save_load(sparse, tmp_path):
+    with rasterio.open(sparse) as src:
+        index = CoverageIndex.from_source(src)
+    path = str(tmp_path / 'coverage.npz')
+    index.save(path)
+
+    loaded = CoverageIndex.load(path)
+    assert np.array_equal(loaded.fraction, index.fraction)
+    assert loaded.transform == index.transform
+    assert loaded.crs == index.crs
+
+    sdg = SpatialDataGenerator(source=sparse)
+    df = sdg.regular_grid(64, 64)
+    assert len(sdg.filter_nodata(df, 0, index=loaded)) == len(df) // 2
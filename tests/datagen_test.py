@@ -2,10 +2,12 @@
 # -*- coding: utf-8 -*-
 
 import pytest
-from keras_spatial.datagen import SpatialDataGenerator
+from keras_spatial.datagen import SpatialDataGenerator, bounds_to_windows
+from keras_spatial.datagen import prefetch_iterator
 import keras_spatial.grid as grid
 from geopandas import GeoDataFrame
 from rasterio.crs import CRS
+from rasterio.vrt import WarpedVRT
 import numpy as np
 
 __author__ = "Jeff Terstriep"
@@ -218,3 +220,311 @@ def test_preprocess_add_array():
     assert arr.shape[1] == 2
     assert arr.shape[-2] == size[0] and arr.shape[-1] == size[1]
 
+def test_batch_preprocess():
+
+    def pre(arr, maxval, scale=1):
+        return arr / maxval * scale
+
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif', indexes=1,
+            preprocess=('normalize', pre, (2,)))
+    df = sdg.regular_grid(*size)
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+
+    sdg.del_preprocess_callback('normalize')
+    sdg.add_batch_preprocess_callback('normalize', pre, 2)
+    assert np.array_equal(np.concatenate(list(
+            sdg.flow_from_dataframe(df, *size))), expected)
+
+    # batch callbacks run after per-sample callbacks
+    sdg.add_preprocess_callback('add', lambda a: np.stack((a, a)))
+    sdg.add_batch_preprocess_callback('scale', pre, 1, scale=4)
+    arr = next(sdg.flow_from_dataframe(df, *size, batch_size=5))
+    assert arr.shape == (5, 2) + size
+    assert np.allclose(arr[:, 1], expected[:5] * 4)
+
+    sdg = SpatialDataGenerator(source='data/small.tif', indexes=1,
+            batch_preprocess=[('type', np.asarray, (), {'dtype': 'float16'})])
+    arr = next(sdg.flow_from_dataframe(df, *size))
+    assert arr.dtype == np.float16
+    sdg.del_batch_preprocess_callback('type')
+    assert not sdg.batch_preprocess
+
+
+def test_flow_from_chunks():
+    size = (100,100)
+    sdg = SpatialDataGenerator()
+    sdg.source = 'data/small.tif'
+    df = sdg.regular_grid(*size)
+    chunks = sdg.regular_grid_chunks(*size, chunksize=7)
+
+    batches = list(sdg.flow_from_dataframe(chunks, *size, batch_size=5))
+    assert sum([batch.shape[0] for batch in batches]) == len(df)
+    assert all(batch.shape[0] == 5 for batch in batches[:-1])
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    assert np.array_equal(np.concatenate(batches), expected)
+
+def test_bounds_to_windows():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.random_grid(64, 64, 20)
+
+    windows = bounds_to_windows(sdg.src.transform, df.geometry.values.bounds)
+    for window, bounds in zip(windows, df.bounds.itertuples()):
+        bot, left = sdg.src.index(bounds[1], bounds[2])
+        top, right = sdg.src.index(bounds[3], bounds[4])
+        assert tuple(window) == (left, top, right-left, bot-top)
+
+def test_get_batch_bounds_array():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64).iloc[:4]
+
+    arr = sdg.get_batch(sdg.src, df.geometry)
+    assert arr.shape == (4, 64, 64, 1)
+    assert np.array_equal(arr, sdg.get_batch(sdg.src, df.bounds.to_numpy()))
+
+def test_get_batch_out():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64).iloc[:4]
+
+    out = sdg.allocate_batch(4, 64, 64)
+    arr = sdg.get_batch(sdg.src, df.geometry, out=out)
+    assert arr is out
+    assert np.array_equal(arr, sdg.get_batch(sdg.src, df.geometry))
+
+def test_flow_buffers():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(*size)
+
+    expected = [b.copy() for b in sdg.flow_from_dataframe(df, *size)]
+    batches = []
+    for batch in sdg.flow_from_dataframe(df, *size, buffers=2):
+        batches.append(batch)
+        assert np.array_equal(batch, expected[len(batches)-1])
+    assert np.shares_memory(batches[0], batches[2])
+    assert not np.shares_memory(batches[0], batches[1])
+
+def test_workers():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(*size)
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    sdg.workers = 4
+    arr = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    assert np.array_equal(arr, expected)
+
+def test_prefetch():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(*size)
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    gen = sdg.flow_from_dataframe(df, *size, prefetch=2, buffers=4)
+    arr = np.concatenate([b.copy() for b in gen])
+    assert np.array_equal(arr, expected)
+
+    with pytest.raises(ValueError):
+        next(sdg.flow_from_dataframe(df, *size, prefetch=2, buffers=2))
+
+def test_prefetch_close():
+    closed = []
+
+    def produce():
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            closed.append(True)
+
+    gen = prefetch_iterator(produce(), 2)
+    assert next(gen) == 0 and next(gen) == 1
+    gen.close()
+    assert closed
+
+def test_prefetch_exception():
+
+    def produce():
+        yield 1
+        raise RuntimeError('failed')
+
+    gen = prefetch_iterator(produce(), 2)
+    assert next(gen) == 1
+    with pytest.raises(RuntimeError):
+        next(gen)
+
+def test_vrt_reuse():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(32, 32)
+
+    list(sdg.flow_from_dataframe(df, *size))
+    (vrt, busy, _, _), = sdg._vrts.values()
+    assert not busy
+    list(sdg.flow_from_dataframe(df, *size))
+    assert list(sdg._vrts.values())[0][0] is vrt
+
+def test_vrt_exclusive():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(32, 32)
+
+    gens = [sdg.flow_from_dataframe(df, *size) for i in range(2)]
+    for gen in gens:
+        next(gen)
+    (a, _, _, src_a), (b, _, _, src_b) = sdg._vrts.values()
+    assert a is not b
+    assert src_a is not src_b and src_a is not sdg.src
+    for gen in gens:
+        gen.close()
+    assert not any(busy for _, busy, _, _ in sdg._vrts.values())
+
+def test_vrt_evict():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    sdg.max_vrts = 2
+    df = sdg.regular_grid(32, 32)
+
+    gens = [sdg.flow_from_dataframe(df.iloc[i*31:], *size) for i in range(3)]
+    for gen in gens:
+        next(gen)
+    assert len(sdg._vrts) == 3
+    for gen in gens:
+        gen.close()
+    assert len(sdg._vrts) == 2
+
+def test_vrt_reuse_workers():
+    size = (64,64)
+    sdg = SpatialDataGenerator(source='data/small.tif', workers=3)
+    df = sdg.regular_grid(32, 32)
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    vrts = [entry[0] for entry in sdg._vrts.values()]
+    assert 1 < len(vrts) <= 4
+    result = np.concatenate(list(sdg.flow_from_dataframe(df, *size)))
+    assert not any(vrt.closed for vrt in vrts)
+    assert all(any(vrt is entry[0] for entry in sdg._vrts.values())
+            for vrt in vrts)
+    assert np.array_equal(result, expected)
+
+def test_context_manager():
+    with SpatialDataGenerator(source='data/small.tif') as sdg:
+        df = sdg.regular_grid(32, 32)
+        next(sdg.flow_from_dataframe(df, 64, 64))
+        vrt = list(sdg._vrts.values())[0][0]
+    assert vrt.closed
+    assert sdg.src is None
+
+def test_read_mode():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+
+    assert sdg.read_mode(sdg.regular_grid(64, 64), 64, 64) == 'direct'
+    assert sdg.read_mode(sdg.regular_grid(64, 64), 16, 16) == 'decimate'
+    assert sdg.read_mode(sdg.regular_grid(64, 64), 128, 128) == 'warp'
+    assert sdg.read_mode(sdg.regular_grid(64, 64).to_crs('EPSG:4326'),
+            64, 64) == 'warp'
+    df = sdg.regular_grid(64, 64)
+    df = GeoDataFrame(geometry=df.translate(0.5, 0), crs=df.crs)
+    assert sdg.read_mode(df, 64, 64) == 'warp'
+
+def test_direct_matches_warp():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    direct = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    assert not any(isinstance(e[0], WarpedVRT) for e in sdg._vrts.values())
+    options = sdg.vrt_options(df, 64, 64)
+    _, vrt = sdg._acquire_vrt(options)
+    windows = bounds_to_windows(options['transform'],
+            df.geometry.values.bounds)
+    assert np.array_equal(direct, sdg.read_windows(vrt, windows))
+
+def test_flow_order():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    df = df.iloc[np.random.default_rng(0).permutation(len(df))]
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100,
+            batch_size=4)))
+
+    for order in ('hilbert', 'zorder', 'block'):
+        batches = list(sdg.flow_from_dataframe(df, 100, 100, batch_size=4,
+                order=order, order_window=2))
+        positions = sdg.sample_order(df, 100, 100, order, window=8)
+        assert np.array_equal(np.concatenate(batches), expected[positions])
+
+    with pytest.raises(ValueError):
+        next(sdg.flow_from_dataframe(df, 100, 100, order='random'))
+
+def test_block_order_crs():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    df = df.iloc[np.random.default_rng(0).permutation(len(df))]
+
+    expected = sdg.sample_order(df, 100, 100, 'block')
+    positions = sdg.sample_order(df.to_crs('EPSG:4326'), 100, 100, 'block')
+    assert np.array_equal(positions, expected)
+
+def test_halo():
+    from keras_spatial.augmentation import terrain_analysis
+
+    def terrain(arr):
+        return terrain_analysis(arr, arr.shape[::-1])
+
+    sdg = SpatialDataGenerator(source='data/small.tif', indexes=1)
+    full = terrain(sdg.src.read(1))
+    left, bottom, right, top = sdg.src.bounds
+    df = grid.regular_grid(left+100, bottom+100, right-100, top-100,
+            100, 100, crs=sdg.src.crs)
+
+    sdg.halo = 2
+    sdg.add_preprocess_callback('terrain', terrain)
+    assert sdg.read_mode(df, 100, 100) == 'direct'
+    batches = list(sdg.flow_from_dataframe(df, 100, 100, buffers=2))
+    arr = np.concatenate(batches)
+    assert arr.shape == (len(df), 6, 100, 100)
+    for sample, (minx, _, _, maxy) in zip(arr, df.geometry.bounds.values):
+        col, row = int(minx - left), int(top - maxy)
+        assert np.allclose(sample, full[:, row:row+100, col:col+100],
+                equal_nan=True)
+
+def test_halo_edge():
+    seen = []
+
+    def keep(batch):
+        seen.append(batch.copy())
+        return batch
+
+    sdg = SpatialDataGenerator(source='data/small.tif', indexes=1, halo=2,
+            batch_preprocess=('keep', keep))
+    left, _, _, top = sdg.src.bounds
+    df = sdg.regular_grid(100, 100)
+    assert sdg.read_mode(df, 100, 100) == 'direct'
+
+    padded = np.pad(sdg.src.read(1), 2, mode='symmetric')
+    for workers in (1, 2):
+        seen.clear()
+        sdg.workers = workers
+        arr = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100)))
+        assert arr.shape == (len(df), 100, 100)
+        for sample, (minx, _, _, maxy) in zip(np.concatenate(seen),
+                df.geometry.bounds.values):
+            col, row = int(minx - left), int(top - maxy)
+            assert np.array_equal(sample, padded[row:row+104, col:col+104])
+
+    # halos past the source are reflected on the warp path too
+    seen.clear()
+    sdg.workers = 1
+    df = sdg.regular_grid(32, 32)
+    next(sdg.flow_from_dataframe(df, 64, 64))
+    assert seen[0].shape[1:] == (68, 68)
+    assert not (seen[0] == sdg.src.nodata).any()
+
+def test_halo_warp():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(32, 32)
+    assert sdg.read_mode(df, 64, 64) == 'warp'
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+
+    sdg.halo = 3
+    arr = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    assert np.array_equal(arr, expected)
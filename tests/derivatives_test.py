@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+import rasterio
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.augmentation import terrain_analysis
+from keras_spatial.derivatives import terrain_raster, tile_windows, BANDS
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def test_tile_windows():
+    windows = tile_windows(1000, 700, 256)
+    assert len(windows) == 4 * 3
+    assert sum(w.width * w.height for w in windows) == 1000 * 700
+
+def _dem(path, nodata):
+    """copy small.tif with nodata holes, one crossing a tile edge"""
+
+    with rasterio.open('data/small.tif') as src:
+        profile = dict(src.profile, nodata=nodata)
+        elevation = src.read(1)
+    elevation[100:110, 295:305] = nodata
+    elevation[0, 0] = nodata
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(elevation, 1)
+    return elevation
+
+@pytest.mark.parametrize('workers,cog,nodata', [(1, True, -9999),
+        (2, False, np.nan)])
+def test_terrain_raster(tmp_path, workers, cog, nodata):
+    dem = str(tmp_path / 'dem.tif')
+    elevation = _dem(dem, nodata)
+    path = str(tmp_path / 'terrain.tif')
+    terrain_raster(dem, path, tilesize=300, workers=workers, cog=cog)
+
+    with rasterio.open(dem) as src:
+        size = (src.width * src.res[0], src.height * src.res[1])
+    expected = terrain_analysis(elevation, size, dtype=np.float32)
+    invalid = np.isnan(elevation) if np.isnan(nodata) else \
+            elevation == nodata
+    padded = np.pad(invalid, 1)
+    h, w = invalid.shape
+    window = np.any([padded[r:r+h, c:c+w] for r in range(3)
+            for c in range(3)], axis=0)
+    expected[0, invalid] = nodata
+    expected[1:, window] = nodata
+
+    with rasterio.open(path) as dst:
+        assert dst.count == len(BANDS)
+        assert dst.descriptions == BANDS
+        assert dst.overviews(1)
+        result = dst.read()
+        assert np.allclose(result, expected, equal_nan=True)
+
+        # aspect overviews hold source angles, not their averages
+        aspect = dst.read(3, out_shape=(h // 2, w // 2))
+        assert np.isin(aspect[~np.isnan(aspect)], result[2]).all()
+
+    sdg = SpatialDataGenerator(source=path, indexes=[2, 3])
+    df = sdg.regular_grid(100, 100)
+    batch = next(sdg.flow_from_dataframe(df, 100, 100, batch_size=1))
+    assert batch.shape == (1, 100, 100, 2)
+
+def test_terrain_raster_rewritten(tmp_path):
+    dem = str(tmp_path / 'dem.tif')
+    path = str(tmp_path / 'terrain.tif')
+    for nodata in (-9999, -1):
+        elevation = _dem(dem, nodata)
+        terrain_raster(dem, path, tilesize=300, cog=False)
+        with rasterio.open(path) as dst:
+            assert np.array_equal(dst.read(1), elevation)
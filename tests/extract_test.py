@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.extract import extract, spatial_shards
+from keras_spatial.samples import spatial_order
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def test_spatial_order():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(250, 250)
+
+    order = spatial_order(df)
+    assert sorted(order) == list(range(len(df)))
+    # 4x4 grid, z-order visits each 2x2 quadrant in turn
+    assert sorted(order[:4]) == [0, 1, 4, 5]
+
+    order = spatial_order(df, curve='hilbert')
+    assert sorted(order) == list(range(len(df)))
+    assert sorted(order[:4]) in ([0, 1, 4, 5], [8, 9, 12, 13])
+    with pytest.raises(ValueError):
+        spatial_order(df, curve='peano')
+
+def test_spatial_order_window():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    order = spatial_order(df, window=10)
+    assert sorted(order) == list(range(len(df)))
+    for i in range(0, len(df), 10):
+        assert sorted(order[i:i+10]) == list(range(i, min(i+10, len(df))))
+
+def test_spatial_shards():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    shards = spatial_shards(df, 3)
+    assert len(shards) == 3
+    assert sorted(np.concatenate(shards)) == list(range(len(df)))
+
+def test_extract(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    path = str(tmp_path / 'out.npy')
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100)))
+    count = extract(sdg, df, path, 100, 100, workers=2)
+    assert count == len(df)
+    assert np.array_equal(np.load(path), expected)
+
+def test_extract_cache(tmp_path):
+    from keras_spatial.cache import PatchCache
+
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(50, 50)
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 50, 50)))
+
+    # worker processes skip the cache so they cannot overwrite its rows
+    sdg.cache = PatchCache(str(tmp_path / 'cache'))
+    path = str(tmp_path / 'out.npy')
+    assert extract(sdg, df, path, 50, 50, batch_size=8, workers=4) == len(df)
+    assert np.array_equal(np.load(path), expected)
+
+    cached = SpatialDataGenerator(source='data/small.tif',
+            cache=str(tmp_path / 'cache'))
+    assert np.array_equal(np.concatenate(list(cached.flow_from_dataframe(df,
+            50, 50))), expected)
+
+def test_extract_shards(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    path = str(tmp_path / 'out.npy')
+
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 100, 100)))
+    counts = [extract(sdg, df, path, 100, 100, shard=i, shards=2)
+            for i in range(2)]
+    assert sum(counts) == len(df)
+    assert np.array_equal(np.load(path), expected)
+
+    with pytest.raises(ValueError):
+        extract(sdg, df, path, 32, 32)
@@ -3,11 +3,13 @@
 
 import pytest
 import numpy as np
+import pandas as pd
 from shapely.geometry import Point
-from geopandas import GeoSeries, GeoDataFrame
+from geopandas import GeoSeries, GeoDataFrame, read_file
 
 import keras_spatial.grid as grid
 from keras_spatial.samples import regular_grid, random_grid, point_grid
+from keras_spatial.samples import regular_grid_chunks
 
 
 __author__ = "Jeff Terstriep"
@@ -72,3 +74,49 @@ def test_point_grid():
 
 def test_sample_size():
     bounds, _, _ = grid.raster_meta('data/small.tif')
+
+def test_regular_grid_order():
+    df = regular_grid(0, 0, 300, 200, 100, 100)
+    assert len(df) == 6
+    assert list(df.bounds.minx) == [0, 100, 200, 0, 100, 200]
+    assert list(df.bounds.miny) == [0, 0, 0, 100, 100, 100]
+
+def test_regular_grid_chunks():
+    bounds, _, _ = grid.raster_meta('data/small.tif')
+    size = (bounds[2]-bounds[0], bounds[3]-bounds[1])
+    size = [i/10 for i in size]
+
+    df = regular_grid(*bounds, *size, overlap=.5)
+    chunks = list(regular_grid_chunks(*bounds, *size, overlap=.5,
+            chunksize=30))
+    assert len(chunks) == 14
+    assert max(len(c) for c in chunks) == 30
+    assert list(pd.concat(chunks).index) == list(df.index)
+    assert pd.concat(chunks).geometry.equals(df.geometry)
+
+def test_mask_grid(tmp_path):
+    df = regular_grid(0, 0, 1000, 1000, 50, 50, crs='EPSG:26916')
+    area = Point(500, 500).buffer(300)
+    mask = GeoDataFrame(geometry=[area.intersection(
+            Point(0, 0).buffer(900)), area.difference(
+            Point(0, 0).buffer(900))], crs='EPSG:26916')
+
+    soft = grid.mask_grid(df, mask, chunksize=70)
+    assert list(soft.index) == list(df.index[df.intersects(area)])
+    hard = grid.mask_grid(df, mask, hard=True, chunksize=70)
+    assert list(hard.index) == list(df.index[df.within(area)])
+    assert 0 < len(hard) < len(soft) < len(df)
+
+    path = str(tmp_path / 'mask.gpkg')
+    mask.to_crs('EPSG:4326').to_file(path, driver='GPKG')
+    assert len(grid.mask_grid(df, path, hard=True)) == len(hard)
+
+def test_main_mask(tmp_path):
+    mask = str(tmp_path / 'mask.gpkg')
+    output = str(tmp_path / 'grid.gpkg')
+    GeoDataFrame(geometry=[Point(0.5, 0.5).buffer(0.3)],
+            crs='EPSG:4326').to_file(mask, driver='GPKG')
+
+    grid.main([output, '0.1', '0.1', '-e', '0', '0', '1', '1',
+            '-m', mask, '--hard'])
+    assert 0 < len(read_file(output)) < 100
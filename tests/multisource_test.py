@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+
+from keras_spatial import SpatialDataGenerator, MultiSourceGenerator
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def _sources():
+    dem = SpatialDataGenerator(source='data/small.tif')
+    img = SpatialDataGenerator(source='data/small.tif', indexes=[1, 1])
+    label = SpatialDataGenerator(source='data/small.tif')
+    return dem, img, label
+
+def test_allocate_batch():
+    dem, img, label = _sources()
+
+    msg = MultiSourceGenerator([dem, img], label)
+    x, y = msg.allocate_batch(5, 32, 16)
+    assert x.shape == (5, 16, 32, 3)
+    assert y.shape == (5, 16, 32, 1)
+
+    msg = MultiSourceGenerator([dem, img], interleave='band')
+    x, y = msg.allocate_batch(5, 32, 16)
+    assert x.shape == (5, 3, 16, 32)
+    assert y is None
+
+@pytest.mark.parametrize('size', [64, 128])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_matches_separate(size, workers):
+    dem, img, label = _sources()
+    df = dem.regular_grid(64, 64)
+
+    msg = MultiSourceGenerator([dem, img], label, workers=workers)
+    batches = list(msg.flow_from_dataframe(df, size, size, batch_size=10))
+    assert len(batches) == int(np.ceil(len(df) / 10))
+
+    x = np.concatenate([b[0] for b in batches])
+    y = np.concatenate([b[1] for b in batches])
+    dem = np.concatenate(list(dem.flow_from_dataframe(df, size, size)))
+    img = np.concatenate(list(img.flow_from_dataframe(df, size, size)))
+    assert np.array_equal(x, np.concatenate([dem, img], axis=-1))
+    assert np.array_equal(y, dem)
+    assert not any(busy for _, busy, _, _ in label._vrts.values())
+
+def test_band_interleave_buffers():
+    dem, img, _ = _sources()
+    df = dem.regular_grid(64, 64)
+
+    msg = MultiSourceGenerator([dem, img], interleave='band')
+    x = np.concatenate([b.copy() for b in msg.flow_from_dataframe(df, 64, 64,
+            batch_size=10, buffers=2)])
+    assert x.shape == (len(df), 3, 64, 64)
+    expected = np.concatenate(list(dem.flow_from_dataframe(df, 64, 64)))
+    assert np.array_equal(x[:, 0], expected[..., 0])
+    assert np.array_equal(x[:, 2], expected[..., 0])
+
+def test_preprocess_rejected():
+    dem = SpatialDataGenerator(source='data/small.tif',
+            preprocess=('double', lambda a: a * 2))
+    with pytest.raises(ValueError):
+        MultiSourceGenerator(dem)
+
+def test_halo_rejected():
+    dem = SpatialDataGenerator(source='data/small.tif', halo=1)
+    with pytest.raises(ValueError):
+        MultiSourceGenerator(dem)
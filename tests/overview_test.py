@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.overview import best_level, open_level
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def _with_overviews(tmp_path):
+    source = str(tmp_path / 'small.tif')
+    shutil.copy('data/small.tif', source)
+    with rasterio.open(source, 'r+') as src:
+        src.build_overviews([2, 4, 8], Resampling.nearest)
+    return source
+
+def test_best_level():
+    assert best_level([2, 4, 8], 1.5) is None
+    assert best_level([2, 4, 8], 2) == 0
+    assert best_level([2, 4, 8], 5.3) == 1
+    assert best_level([2, 4, 8], 100) == 2
+
+def test_overview_level(tmp_path):
+    sdg = SpatialDataGenerator(source=_with_overviews(tmp_path))
+    df = sdg.regular_grid(256, 256)
+
+    assert sdg._level(sdg.vrt_options(df, 64, 64)) == (sdg.source, 1)
+    assert sdg._level(sdg.vrt_options(df, 256, 256)) is None
+    assert sdg.read_mode(df, 64, 64) == 'direct'
+
+    arr = next(sdg.flow_from_dataframe(df, 64, 64, batch_size=1))
+    minx, miny, maxx, maxy = df.iloc[0].geometry.bounds
+    with open_level(sdg.source, 1) as ovr:
+        window = ovr.window(minx, miny, maxx, maxy)
+        assert np.array_equal(arr[0,:,:,0], ovr.read(1, window=window))
+
+def test_overviews_disabled(tmp_path):
+    sdg = SpatialDataGenerator(source=_with_overviews(tmp_path),
+            overviews=False)
+    df = sdg.regular_grid(256, 256)
+    assert sdg._level(sdg.vrt_options(df, 64, 64)) is None
+    assert sdg.read_mode(df, 64, 64) == 'decimate'
+
+def test_overview_cache(tmp_path):
+    cache = str(tmp_path / 'ovr')
+    sdg = SpatialDataGenerator(source='data/small.tif', overview_cache=cache)
+    df = sdg.regular_grid(256, 256)
+
+    path, level = sdg._level(sdg.vrt_options(df, 64, 64))
+    assert os.path.dirname(path) == cache and level is None
+    mtime = os.stat(path).st_mtime_ns
+
+    batch = next(sdg.flow_from_dataframe(df, 64, 64))
+    assert batch.shape[1:3] == (64, 64)
+    assert sdg._level(sdg.vrt_options(df, 32, 32)) == (path, None)
+    assert os.stat(path).st_mtime_ns == mtime
@@ -31,3 +31,37 @@ def test_nodata():
     ag.fill(df, sdg, 64, 64)
     assert 'nodata' in df.columns
 
+
+def test_stats_match_per_sample():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    arrs = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+
+    ag = AttributeGenerator()
+    ag.stats()
+    ag.nodata(arrs.flat[0])
+    ag.append('first', lambda a: a.flat[0])
+    for workers in (1, 3):
+        out = ag.fill(df.copy(), sdg, 64, 64, batch_size=7, workers=workers)
+        assert np.array_equal(out['min'], [a.min() for a in arrs])
+        assert np.array_equal(out['max'], [a.max() for a in arrs])
+        assert np.allclose(out['mean'], [a.mean() for a in arrs])
+        assert np.allclose(out['std'], [a.std() for a in arrs])
+        assert list(out['nodata']) == [(a == arrs.flat[0]).sum() for a in arrs]
+        assert list(out['first']) == [a.flat[0] for a in arrs]
+
+def test_fill_workers_skip_cache(tmp_path):
+    from keras_spatial.cache import PatchCache
+
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    expected = AttributeGenerator()
+    expected.minmax()
+    expected = expected.fill(df.copy(), sdg, 64, 64)
+
+    sdg.cache = PatchCache(str(tmp_path))
+    ag = AttributeGenerator()
+    ag.minmax()
+    out = ag.fill(df.copy(), sdg, 64, 64, batch_size=7, workers=3)
+    assert np.array_equal(out['min'], expected['min'])
+    assert not list(tmp_path.iterdir())
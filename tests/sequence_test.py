@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pickle
+import pytest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from keras_spatial import SpatialDataGenerator, SpatialSequence
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "Jeff Terstriep"
+__license__ = "mit"
+
+
+def _batch(seq, index):
+    return seq[index]
+
+def test_len():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64, batch_size=10)
+    assert len(seq) == int(np.ceil(len(df) / 10))
+    assert seq[len(seq)-1].shape[0] == len(df) - 10 * (len(seq)-1)
+    with pytest.raises(IndexError):
+        seq[len(seq)]
+
+def test_matches_flow():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64)
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    assert np.array_equal(np.concatenate([seq[i] for i in range(len(seq))]),
+            expected)
+
+def test_halo():
+    sdg = SpatialDataGenerator(source='data/small.tif', halo=2,
+            batch_preprocess=('shift', lambda a: a[:, 1:-1, 1:-1] + 1))
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64)
+    expected = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+    assert expected.shape[1:3] == (64, 64)
+    assert np.array_equal(np.concatenate([seq[i] for i in range(len(seq))]),
+            expected)
+
+def test_y_col_shuffle():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+    df['label'] = np.arange(len(df))
+
+    seq = SpatialSequence(sdg, df, 64, 64, y_col='label', shuffle=True,
+            seed=1)
+    x, y = seq[0]
+    assert x.shape[0] == y.shape[0] == sdg.batch_size
+    first = seq.order.copy()
+    seq.on_epoch_end()
+    assert sorted(seq.order) == sorted(first)
+    assert not np.array_equal(seq.order, first)
+
+def test_pickle():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64)
+    expected = seq[1]
+    copy = pickle.loads(pickle.dumps(seq))
+    assert np.array_equal(copy[1], expected)
+
+def test_processes():
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64)
+    expected = seq[2]
+    with ProcessPoolExecutor(2) as executor:
+        result = list(executor.map(_batch, [seq, seq], [2, 2]))
+    assert all(np.array_equal(r, expected) for r in result)
+
+def test_threads():
+    sdg = SpatialDataGenerator(source='data/small.tif', batch_size=4)
+    df = sdg.regular_grid(64, 64)
+
+    seq = SpatialSequence(sdg, df, 64, 64)
+    expected = [seq[i] for i in range(len(seq))]
+    seq.close()
+    with ThreadPoolExecutor(8) as executor:
+        result = list(executor.map(seq.__getitem__, range(len(seq))))
+    assert all(np.array_equal(r, e) for r, e in zip(result, expected))
+    assert 1 <= len(seq._handles) <= 8
+    seq.close()
+    assert not seq._handles
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+import numpy as np
+
+from keras_spatial import SpatialDataGenerator
+from keras_spatial.stats import BandStats, band_stats
+from keras_spatial.cache import PatchCache
+
+__author__ = "Jeff Terstriep"
+__copyright__ = "University of Illinois Board of Trustees"
+__license__ = "ncsa"
+
+
+def test_update_matches_numpy():
+    rng = np.random.default_rng(0)
+    data = rng.normal(50, 10, (40, 8, 8, 2)) * [1, 100]
+
+    stats = BandStats(bands=2)
+    for i in range(0, len(data), 7):
+        stats.update(data[i:i+7])
+
+    flat = data.reshape(-1, 2)
+    assert list(stats.count) == [len(flat)] * 2
+    assert np.allclose(stats.mean, flat.mean(axis=0))
+    assert np.allclose(stats.std, flat.std(axis=0))
+    assert np.array_equal(stats.min, flat.min(axis=0))
+    assert np.array_equal(stats.max, flat.max(axis=0))
+    width = (flat.max(axis=0) - flat.min(axis=0)) * 4 / stats.bins
+    assert np.all(np.abs(stats.percentile(50) - np.median(flat, axis=0))
+            < width)
+    assert stats.percentile([0, 100]).shape == (2, 2)
+
+def test_merge_and_nodata():
+    rng = np.random.default_rng(1)
+    data = rng.uniform(0, 10, (20, 2, 4, 4))
+    data[0, 0, 0, 0] = -9999
+    data[1, 1, 0, 0] = np.nan
+
+    whole = BandStats(bands=2, axis=1, nodata=-9999)
+    whole.update(data)
+    part = BandStats(bands=2, axis=1, nodata=-9999)
+    part.update(data[:10])
+    other = BandStats(bands=2, axis=1, nodata=-9999)
+    other.update(data[10:] * 3)
+    part.merge(other)
+
+    both = np.concatenate([data[:10], data[10:] * 3])
+    valid = np.moveaxis(both, 1, -1).reshape(-1, 2)
+    assert list(part.count) == [len(valid) - 1] * 2
+    assert np.isclose(part.mean[0], valid[valid[:, 0] != -9999, 0].mean())
+    assert np.isclose(part.std[1], np.nanstd(valid[:, 1]))
+    assert part.hist.sum() == part.count.sum()
+    assert whole.min[0] >= 0
+    with pytest.raises(ValueError):
+        part.update(np.zeros((1, 3, 4, 4)))
+
+def test_save_load(tmp_path):
+    stats = BandStats(bands=1, axis=None)
+    stats.update(np.arange(100.0).reshape(4, 5, 5))
+    path = str(tmp_path / 'stats.npz')
+    stats.save(path)
+
+    loaded = BandStats.load(path)
+    assert loaded.axis is None and loaded.nodata is None
+    for name in ('count', 'mean', 'm2', 'min', 'max', 'hist', 'edges'):
+        assert np.array_equal(getattr(loaded, name), getattr(stats, name))
+
+def test_band_stats(tmp_path):
+    sdg = SpatialDataGenerator(source='data/small.tif')
+    df = sdg.regular_grid(100, 100)
+    data = np.concatenate(list(sdg.flow_from_dataframe(df, 64, 64)))
+
+    for workers in (1, 3):
+        stats = band_stats(sdg, df, 64, 64, batch_size=7, workers=workers)
+        assert np.allclose(stats.mean, data.mean())
+        assert np.allclose(stats.max, data.max())
+
+    # worker copies leave the patch cache untouched
+    sdg.cache = PatchCache(str(tmp_path))
+    stats = band_stats(sdg, df, 64, 64, batch_size=7, workers=3)
+    assert np.allclose(stats.mean, data.mean())
+    assert not list(tmp_path.iterdir())
+    sdg.cache = None
+
+    # as a batch callback while walking the generator
+    stats = BandStats()
+    sdg.add_batch_preprocess_callback('stats', stats)
+    assert sum(len(b) for b in sdg.flow_from_dataframe(df, 64, 64)) == len(df)
+    assert np.allclose(stats.std, data.std())